@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+# /// script
+# requires-python = ">=3.9"
+# dependencies = [
+#     "click",
+# ]
+# ///
+"""Synthetic DKB statements and a benchmark harness for dkbparse.
+
+The generator writes text in the shape `pdftotext -layout` produces for every format the
+parsers accept, so the parsers can be measured and checked without real statements. The
+conformance check compares the extraction backends on real statements.
+"""
+
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import click
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import dkbparse
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+MONTH_NAMES = {no: name for name, no in dkbparse.MONTHS.items()}
+
+PAYEES = [
+    "REWE Markt GmbH", "Stadtwerke München", "Tante Helga", "Amazon EU S.a.r.l.", "Deutsche Bahn AG",
+    "Arbeitgeber GmbH", "Finanzamt Berlin", "Vodafone GmbH", "Netflix International B.V.", "Hausverwaltung Meyer",
+]
+COMMENTS = [
+    "ÜBERWEISUNG DATUM 29.12.2018, 05.33 UHR 1.TAN 123456", "Miete Wohnung EG links",
+    "Lohn/Gehalt 04/2015", "Abschlag Strom Kundennr. 4711", "Referenz: 1234567890123456",
+    "Mandatsreferenz: M-000123, Gläubiger-ID: DE98ZZZ09999999999", "EREF: 2015-04-ABC-0815",
+]
+TYPES_OLD = ["Lastschrift", "Überweisung", "Gutschrift", "Kartenzahlung", "Dauerauftrag"]
+TYPES_NEW = ["Lastschrift", "Überweisung", "Zahlungseingang", "Kartenzahlung", "Dauerauftrag"]
+MERCHANTS = ["AMAZON DE MARKETPLACE", "LIDL SAGT DANKE", "SHELL 1234", "SPOTIFY P0123456", "DB BAHN A-NR XYZ"]
+FOREIGN = [("GBP", "0,8612"), ("USD", "1,1372"), ("CHF", "0,9815"), ("DKK", "7,4601"), ("JPY", "160,12")]
+
+# pdftotext -layout columns of the old bank statement table
+OLD_HEADER = "Bu.Tag  Wert    Wir haben für Sie gebucht                          Belastung in EUR      Gutschrift in EUR"
+OLD_COMMENT = OLD_HEADER.index("Wir haben")
+OLD_MINUS = OLD_HEADER.index("Belastung in EUR") + len("Belastung in EUR")
+OLD_PLUS = len(OLD_HEADER)
+NEW_HEADER = "Datum      Erläuterung                                                 Betrag Soll EUR          Betrag Haben EUR"
+NEW_SOLL = NEW_HEADER.index("Betrag Soll EUR") + len("Betrag Soll EUR")
+NEW_HABEN = len(NEW_HEADER)
+FOOTER = [
+    "",
+    "Deutsche Kreditbank AG      Taubenstraße 7-9      10117 Berlin      www.dkb.de",
+    "Vorstand: Stefan Unterlandstättner (Vorsitzender), Tilo Hacke, Jan Walther, Kristina Mattke",
+    "",
+]
+
+
+def german(value):
+    """formats a Decimal like 1.234,56"""
+    return f"{abs(value):,.2f}".replace(",", " ").replace(".", ",").replace(" ", ".")
+
+
+def right(text, value, column):
+    """appends value to text so that it ends in column"""
+    return text + " " * max(3, column - len(text) - len(value)) + value
+
+
+def amount(rng):
+    return Decimal(rng.choice([rng.randint(1, 99), rng.randint(100, 999), rng.randint(1000, 4999)])) + Decimal(rng.randint(0, 99)) / 100
+
+
+def days(first, rng, transactions):
+    """returns sorted dates of one month starting at first"""
+    return sorted(first + timedelta(days=rng.randint(0, 27)) for _ in range(transactions))
+
+
+def details(rng):
+    lines = [rng.choice(PAYEES)]
+    lines.extend(rng.sample(COMMENTS, rng.randint(0, 3)))
+    return lines
+
+
+def old_bank_statement(transactions=40, no=4, year=2015, account="1010001491", per_page=25, seed=0, balance=None):
+    """returns (filename, text) of an old format bank statement, see re_range and re_transaction
+
+    balance is the old balance, random unless given"""
+    rng = random.Random(seed)
+    first = date(year, 1, 1) + timedelta(days=28 * (no - 1))
+    last = first + timedelta(days=27)
+    opening = Decimal(rng.randint(-500, 5000))
+    balance = opening if balance is None else balance
+    header = [
+        f"Kontoauszug Nummer {no:03} / {year} vom {first:%d.%m.%Y} bis {last:%d.%m.%Y}",
+        f"Kontonummer {account} / IBAN DE12 1203 0000 {account[:4]} {account[4:8]} {account[8:]}",
+        "",
+    ]
+    lines = header + [f"ALTER KONTOSTAND                                  {german(balance)} {'S' if balance < 0 else 'H'} EUR", "", OLD_HEADER]
+    for i, day in enumerate(days(first, rng, transactions)):
+        if i and i % per_page == 0:
+            lines += FOOTER + [f"{' ' * 80}Seite {i // per_page} von {transactions // per_page + 1}", "\f"] + header + [OLD_HEADER]
+        value = amount(rng) * (1 if rng.random() < 0.3 else -1)
+        balance += value
+        row = f"{day:%d.%m.}   {day:%d.%m.}   {rng.choice(TYPES_OLD)}"
+        lines.append(right(row, german(value), OLD_MINUS if value < 0 else OLD_PLUS))
+        lines += [" " * OLD_COMMENT + line for line in details(rng)]
+    lines += ["", f"NEUER KONTOSTAND                                  {german(balance)} {'S' if balance < 0 else 'H'} EUR"] + FOOTER
+    filename = f"Kontoauszug_{account}_Nr_{year}_{no:03}_per_{last:%Y_%m_%d}.pdf"
+    return filename, "\n".join(lines) + "\n"
+
+
+def new_bank_statement(transactions=40, no=8, year=2024, account="1010001491", per_page=25, seed=0, balance=None):
+    """returns (filename, text) of a new format bank statement, see re_transaction_new_soll and _haben
+
+    balance is the old balance, random unless given"""
+    rng = random.Random(seed)
+    first = date(year, 1, 1) + timedelta(days=28 * (no - 1))
+    last = first + timedelta(days=27)
+    opening = Decimal(rng.randint(5000, 50000))
+    balance = opening if balance is None else balance
+    signed = lambda value: f"{'-' if value < 0 else ''}{german(value)}"
+    header = [f"Kontoauszug {no}/{year}", "", "Girokonto " + account, ""]
+    lines = header + [right(f"Kontostand am {first:%d.%m.%Y}, Auszug Nr. {no - 1}", signed(balance), NEW_HABEN), "", NEW_HEADER]
+    for i, day in enumerate(days(first, rng, transactions)):
+        if i and i % per_page == 0:
+            lines += FOOTER + [f"{' ' * 80}Seite {i // per_page} von {transactions // per_page + 1}", "\f"] + header + [NEW_HEADER]
+        value = amount(rng) * (1 if rng.random() < 0.3 else -1)
+        balance += value
+        row = f"{day:%d.%m.%Y} {rng.choice(TYPES_NEW)}"
+        if value < 0:
+            lines.append(right(row, "-" + german(value), NEW_SOLL))
+        else:
+            lines.append(row + " " * max(70, NEW_HABEN - len(row) - len(german(value))) + german(value))
+        lines += [" " * 14 + line for line in details(rng)]
+    lines += ["", right(f"Kontostand am {last:%d.%m.%Y} um 20:00 Uhr", signed(balance), NEW_HABEN)] + FOOTER
+    filename = f"Kontoauszug_{no}_{year}_vom_{last:%d.%m.%Y}_zu_Konto_{account}.pdf"
+    return filename, "\n".join(lines) + "\n"
+
+
+def visa_statement(transactions=40, month=1, year=2023, card="4930 XXXX XXXX 1234", per_page=25, foreign=0.2, seed=0, balance=None):
+    """returns (filename, text) of a VISA statement, including foreign currency transactions
+
+    balance is the balance of the last statement, random unless given"""
+    rng = random.Random(seed)
+    first = date(year, month, 1)
+    last = first + timedelta(days=27)
+    opening = -Decimal(rng.randint(0, 2000))
+    balance = opening if balance is None else balance
+    signed = lambda value: f"{german(value)} {'-' if value < 0 else '+'}"
+    header = [f"   DKB-VISA-Card: {card}", f"   Abrechnung:  {MONTH_NAMES[month]} {year}", ""]
+    lines = header + [
+        f"Ihre Abrechnung vom {first:%d.%m.%Y} bis {last:%d.%m.%Y}",
+        "",
+        "Datum    Datum    Angabe des Unternehmens /           Währung   Betrag     Kurs       Betrag in",
+        right(f" {first - timedelta(days=1):%d.%m.%y}  Saldo letzte Abrechnung", signed(balance), 100),
+    ]
+    for i, day in enumerate(days(first, rng, transactions)):
+        if i and i % per_page == 0:
+            page = i // per_page
+            lines.append(right(f"  Zwischensumme Seite {page}", signed(balance), 100))
+            lines += FOOTER + ["\f"] + header + [right(f"  Übertrag von Seite {page}", signed(balance), 100)]
+        value = -amount(rng) if rng.random() < 0.9 else amount(rng)
+        balance += value
+        row = f"{day:%d.%m.%y} {day + timedelta(days=1):%d.%m.%y} {rng.choice(MERCHANTS)}"
+        if rng.random() < foreign:
+            currency, rate = rng.choice(FOREIGN)
+            row = right(row, f"{currency}   {german(value * Decimal(rate.replace(',', '.')))}   {rate}", 80)
+        lines.append(right(row, signed(value), 100))
+        if rng.random() < 0.2:
+            lines.append(" " * 18 + f"Kartenzahlung {rng.randint(1000, 9999)}")
+    lines += ["", right("  Neuer Saldo", signed(balance), 100)] + FOOTER
+    filename = f"Kreditkartenabrechnung_{card[:4]}xxxxxxxx{card[-4:]}_per_{last:%Y_%m_%d}.pdf"
+    return filename, "\n".join(lines) + "\n"
+
+
+GENERATORS = {"old": old_bank_statement, "new": new_bank_statement, "visa": visa_statement}
+
+
+def archive(directory, statements=12, transactions=40, seed=0):
+    """writes statements of every kind as text files named like the PDFs into directory
+
+    The statements of each kind are numbered without gaps and every one starts with the balance
+    the one before it ended with, like a real archive. Old and new bank statements are of two
+    accounts, each a chain of its own."""
+    accounts = {"old": "1010001491", "new": "1010001492"}
+    balances = {}
+    for i in range(statements):
+        for kind, generator in GENERATORS.items():
+            if kind == "visa":
+                filename, text = generator(transactions, month=i % 12 + 1, year=2020 + i // 12, seed=seed + i, balance=balances.get(kind))
+            else:
+                filename, text = generator(transactions, no=i % 12 + 1, year=(2015 if kind == "old" else 2024) + i // 12, account=accounts[kind], seed=seed + i, balance=balances.get(kind))
+            balances[kind] = parse(kind, filename, text)[1]["balance_new"]
+            os.makedirs(os.path.join(directory, kind), exist_ok=True)
+            with open(os.path.join(directory, kind, filename), "w") as f:
+                f.write(text)
+
+
+class TextExtractor:
+    """stand-in for the pdftotext extractor, the synthetic statements already are pdftotext output"""
+
+    def version(self):
+        return "text"
+
+    def extract(self, fname):
+        with open(fname) as f:
+            return f.read()
+
+    def iter_lines(self, fname):
+        with open(fname) as f:
+            for line in f:
+                yield from line.splitlines()
+
+
+def parse(kind, filename, text):
+    if kind == "visa":
+        return dkbparse.read_visa_statement(filename, text)
+    return dkbparse.read_bank_statement(filename, text)
+
+
+def measure_parse(kind, transactions, repeat):
+    """returns lines/s and peak memory in bytes for parsing one statement of kind"""
+    filename, text = GENERATORS[kind](transactions)
+    lines = text.count("\n")
+    parse(kind, filename, text)  # warm up
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        parse(kind, filename, text)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    parse(kind, filename, text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"lines_per_second": lines / best, "peak_memory": peak}
+
+
+def measure_cli(statements, transactions, repeat):
+    """returns the best wall time of a whole dkbparse run over a synthetic archive, without pdftotext"""
+    pdftotext = dkbparse.EXTRACTORS["pdftotext"]
+    dkbparse.EXTRACTORS["pdftotext"] = TextExtractor
+    dkbparse.get_extractor.cache_clear()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            archive(directory, statements, transactions)
+            output = os.path.join(directory, "out.csv")
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                dkbparse.main([directory, "--output", output, "--no-cache", "--jobs", "1"], standalone_mode=False)
+                best = min(best, time.perf_counter() - start)
+    finally:
+        dkbparse.EXTRACTORS["pdftotext"] = pdftotext
+        dkbparse.get_extractor.cache_clear()
+    return {"seconds": best}
+
+
+def adversarial_lines(length):
+    """returns near misses of about length characters for the line patterns
+
+    Long runs of blanks and many short words between the columns are what makes patterns with
+    adjacent quantifiers backtrack, the lines end so that no pattern matches in the end."""
+    words = length // 2
+    return {
+        "blank run after a date": "01.02.2024" + " " * length + "x",
+        "blank run before an amount": "01.02.2024 A" + " " * length + "1,00 x",
+        "words after a date": "01.02.2024 " + "A " * words + "x",
+        "blank columns": "01.02.2024 A" + (" " * 69 + "B") * (length // 70) + " 1,00x",
+        "indentation": " " * length + "x-",
+        "indented date": " " * (length // 2) + "01.02.20" + " " * (length // 2) + "x 1,00 -x-",
+        "words after two dates": "01.02.20 02.02.20 " + "AB " * (length // 3) + "-",
+        "currencies": "01.02.20 02.02.20 X" + " USD 1,00" * (length // 9) + " x-",
+        "words ending in a sign": "  " + "a " * words + "+",
+        "amounts": "   " + "1.234,56 " * (length // 9) + "EUR",
+        "old format columns": "02.04.   02.04.   " + "Lastschrift   " * (length // 14) + "x",
+    }
+
+
+def measure_adversarial(length, repeat):
+    """returns the worst time in seconds of every line pattern of dkbparse over the adversarial lines"""
+    patterns = {name: value for name, value in vars(dkbparse).items() if name.startswith("re_") and hasattr(value, "match")}
+    lines = adversarial_lines(length)
+    results = {}
+    for name, pattern in patterns.items():
+        worst, worst_line = 0, None
+        for label, line in lines.items():
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                pattern.match(line)
+                best = min(best, time.perf_counter() - start)
+            if best > worst:
+                worst, worst_line = best, label
+        results[name] = (worst, worst_line)
+    return results
+
+
+def history_exports(statements, transactions):
+    """returns the DKB CSV, MoneyMoney CSV and JSON export of a synthetic archive as text"""
+    parsed = []
+    with tempfile.TemporaryDirectory() as directory:
+        archive(directory, statements, transactions)
+        for kind in GENERATORS:
+            for filename in sorted(os.listdir(os.path.join(directory, kind))):
+                with open(os.path.join(directory, kind, filename)) as f:
+                    parsed.extend(parse(kind, filename, f.read())[0])
+    exports = {}
+    for format in ("dkb", "moneymoney", "json"):
+        f = io.StringIO()
+        dkbparse.write_transactions([dkbparse.SINKS[format](f)], parsed)
+        exports[format] = f.getvalue()
+    return exports
+
+
+def measure_merge(statements, transactions, repeat):
+    """returns the rows read and merged per second for the exports of one synthetic archive in all formats"""
+    exports = history_exports(statements, transactions)
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        merged = dkbparse.MergedExports()
+        rows = 0
+        for format, text in exports.items():
+            exported = dkbparse.EXPORT_READERS[format](io.StringIO(text))
+            rows += len(exported)
+            merged.add(exported, format)
+        best = min(best, time.perf_counter() - start)
+    return {"rows_per_second": rows / best, "rows": rows, "merged": len(merged.transactions)}
+
+
+def import_time(stderr):
+    """returns the seconds spent in top level imports and the number of modules from python -X importtime output"""
+    total, modules = 0, 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # the header
+        modules += 1
+        # nested imports are indented by two more blanks
+        if len(name) - len(name.lstrip()) == 1:
+            total += int(cumulative) / 1e6
+    return total, modules
+
+
+def measure_startup(commands, repeat):
+    """returns the best wall time, import time and imported modules of every command run as a new process
+
+    pdftotext is replaced by cat on PATH, so that the synthetic statements can be read and only
+    Python is measured."""
+    import subprocess
+    results = {}
+    with tempfile.TemporaryDirectory() as bindir:
+        pdftotext = os.path.join(bindir, "pdftotext")
+        with open(pdftotext, "w") as f:
+            f.write('#!/bin/sh\nexec cat "$2"\n')
+        os.chmod(pdftotext, 0o755)
+        env = dict(os.environ, PATH=f"{bindir}{os.pathsep}{os.environ.get('PATH', '')}", PYTHONDONTWRITEBYTECODE="")
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        for name, args in commands.items():
+            subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, check=True)  # writes __pycache__
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, check=True)
+                best = min(best, time.perf_counter() - start)
+            stderr = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=cwd, env=env, capture_output=True, check=True).stderr
+            imports, modules = import_time(stderr.decode())
+            results[name] = {"seconds": best, "imports": imports, "modules": modules}
+    return results
+
+
+def check(results, baseline, tolerance):
+    """returns a list of regressions of results against baseline"""
+    regressions = []
+    for name, result in results.items():
+        for metric, value in result.items():
+            reference = baseline.get(name, {}).get(metric)
+            if reference is None:
+                continue
+            # throughput regresses when it falls, everything else when it grows
+            ratio = reference / value if metric == "lines_per_second" else value / reference
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name} {metric}: {value:,.4g} vs. baseline {reference:,.4g}")
+    return regressions
+
+
+@click.group()
+def cli():
+    """Synthetic DKB statements and benchmarks for dkbparse."""
+
+
+@cli.command()
+@click.argument('directory', type=click.Path(file_okay=False, dir_okay=True))
+@click.option('--statements', '-n', type=click.IntRange(min=1), default=12, show_default=True, help='Statements per kind')
+@click.option('--transactions', '-t', type=click.IntRange(min=1), default=40, show_default=True, help='Transactions per statement')
+@click.option('--seed', type=int, default=0, show_default=True)
+def generate(directory, statements, transactions, seed):
+    """Write a synthetic archive of old, new and VISA statements (as pdftotext text) to DIRECTORY."""
+    archive(directory, statements, transactions, seed)
+
+
+@cli.command()
+@click.argument('directories', nargs=-1, required=True, type=click.Path(exists=True, file_okay=False, dir_okay=True))
+@click.option('--backend', '-b', type=click.Choice(sorted(dkbparse.EXTRACTORS)), default='pypdf', show_default=True)
+def conformance(directories, backend):
+    """Compare the parse results of a backend with pdftotext for the real statements in DIRECTORIES."""
+    logging.disable(logging.WARNING)
+    failures = 0
+    for reader, pdf in dkbparse.find_statements(directories):
+        results = []
+        for name in ("pdftotext", backend):
+            start = time.perf_counter()
+            table = dkbparse.read_pdf_table(pdf, name)
+            elapsed = time.perf_counter() - start
+            try:
+                transactions, statement = reader(pdf, table)
+            except Exception as e:
+                transactions, statement = e, {}
+            results.append((transactions, statement, elapsed))
+        (expected, expected_statement, expected_time), (actual, actual_statement, actual_time) = results
+        if actual == expected and actual_statement == expected_statement:
+            click.echo(f"ok    {pdf} ({expected_time * 1000:.0f}ms / {actual_time * 1000:.0f}ms)")
+            continue
+        failures += 1
+        click.echo(f"FAIL  {pdf}")
+        if isinstance(actual, Exception) or isinstance(expected, Exception):
+            click.echo(f"      pdftotext: {expected!r:.200}\n      {backend}: {actual!r:.200}")
+            continue
+        for key in sorted(expected_statement.keys() | actual_statement.keys()):
+            if expected_statement.get(key) != actual_statement.get(key):
+                click.echo(f"      statement {key}: {expected_statement.get(key)!r} != {actual_statement.get(key)!r}")
+        for e, a in zip(expected, actual):
+            if e != a:
+                click.echo(f"      transaction {e['transaction']}: {e} != {a}")
+        if len(expected) != len(actual):
+            click.echo(f"      {len(expected)} != {len(actual)} transactions")
+    if failures:
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--length', '-l', type=click.IntRange(min=1), default=2000, show_default=True, help='Characters per adversarial line')
+@click.option('--budget', type=float, default=1.0, show_default=True, help='Allowed milliseconds per pattern and line')
+@click.option('--repeat', '-r', type=click.IntRange(min=1), default=3, show_default=True)
+def adversarial(length, budget, repeat):
+    """Time every line pattern on near misses built to make it backtrack, fail if one exceeds the budget."""
+    over = 0
+    for name, (seconds, line) in sorted(measure_adversarial(length, repeat).items(), key=lambda item: -item[1][0]):
+        status = "ok" if seconds * 1000 <= budget else "OVER"
+        over += status == "OVER"
+        click.echo(f"{status:<5} {name:<28} {seconds * 1000:8.3f}ms  {line}")
+    if over:
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--transactions', '-t', type=click.IntRange(min=1), default=40, show_default=True, help='Transactions of the statement')
+@click.option('--repeat', '-r', type=click.IntRange(min=1), default=10, show_default=True)
+@click.option('--budget', type=float, default=0.5, show_default=True, help='Allowed share of the directory command that parse-file may take, beyond the interpreter start')
+def startup(transactions, repeat, budget):
+    """Time cold starts for a single statement: parse-file against the directory command, with -X importtime."""
+    with tempfile.TemporaryDirectory() as directory:
+        filename, text = visa_statement(transactions)
+        statement = os.path.join(directory, filename)
+        with open(statement, "w") as f:
+            f.write(text)
+        results = measure_startup({
+            "interpreter": ["-c", "pass"],
+            "directory": ["dkbparse.py", directory, "--no-cache", "--jobs", "1"],
+            "parse-file": ["-m", "dkbparse", "parse-file", statement],
+        }, repeat)
+    for name, result in results.items():
+        click.echo(f"{name:<12} {result['seconds'] * 1000:8.1f}ms  imports {result['imports'] * 1000:6.1f}ms  {result['modules']:4} modules")
+    interpreter = results["interpreter"]["seconds"]
+    share = (results["parse-file"]["seconds"] - interpreter) / (results["directory"]["seconds"] - interpreter)
+    click.echo(f"parse-file takes {share:.0%} of the time the directory command takes beyond the interpreter start")
+    if share > budget:
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--statements', '-n', type=click.IntRange(min=1), default=4, show_default=True, help='Statements per kind of the smaller archive')
+@click.option('--transactions', '-t', type=click.IntRange(min=1), default=100, show_default=True, help='Transactions per statement')
+@click.option('--scale', type=click.IntRange(min=2), default=8, show_default=True, help='Times more statements in the larger archive')
+@click.option('--repeat', '-r', type=click.IntRange(min=1), default=3, show_default=True)
+@click.option('--budget', type=float, default=2.0, show_default=True, help='Allowed slowdown per row of the larger archive')
+def merge(statements, transactions, scale, repeat, budget):
+    """Time merging the DKB CSV, MoneyMoney CSV and JSON export of an archive at two sizes, fail if the time per row grows beyond the budget."""
+    logging.disable(logging.WARNING)
+    small = measure_merge(statements, transactions, repeat)
+    large = measure_merge(statements * scale, transactions, repeat)
+    for name, result in (("small", small), ("large", large)):
+        click.echo(f"{name:<6} {result['rows']:8,} rows  {result['merged']:8,} merged  {result['rows_per_second']:12,.0f} rows/s")
+    slowdown = small["rows_per_second"] / large["rows_per_second"]
+    click.echo(f"{slowdown:.2f} times the time per row for {scale} times the rows")
+    if slowdown > budget:
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--transactions', '-t', type=click.IntRange(min=1), default=2000, show_default=True, help='Transactions per parsed statement')
+@click.option('--statements', '-n', type=click.IntRange(min=1), default=12, show_default=True, help='Statements per kind in the end-to-end run')
+@click.option('--repeat', '-r', type=click.IntRange(min=1), default=5, show_default=True)
+@click.option('--save', is_flag=True, help='Store the results as the new baseline')
+@click.option('--tolerance', type=float, default=0.25, show_default=True, help='Allowed relative regression against the baseline')
+def run(transactions, statements, repeat, save, tolerance):
+    """Measure parse throughput, peak memory and end-to-end time and compare them with the baseline."""
+    logging.disable(logging.WARNING)
+    results = {f"parse_{kind}": measure_parse(kind, transactions, repeat) for kind in GENERATORS}
+    results["cli"] = measure_cli(statements, transactions // 50 or 1, repeat)
+    for name, result in results.items():
+        click.echo(f"{name:<12} " + "  ".join(f"{metric} {value:,.4g}" for metric, value in result.items()))
+
+    if save:
+        with open(BASELINE, "w") as f:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(), "results": results}, f, indent=1)
+            f.write("\n")
+        return
+    if not os.path.exists(BASELINE):
+        return
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    regressions = check(results, baseline["results"], tolerance)
+    for regression in regressions:
+        click.echo(f"REGRESSION {regression}", err=True)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 # /// script
-# requires-python = ">=3.6"
+# requires-python = ">=3.9"
 # dependencies = [
 #     "click",
 # ]
@@ -12,9 +12,23 @@ import logging
 import csv
 import os
 import sys
-import click
-
-from datetime import datetime
+import heapq
+import time
+import io
+import signal
+import threading
+
+# click, http.server, sqlite3, concurrent.futures, json, hashlib, pickle and tempfile are
+# imported where they are used, parse-file starts without them
+
+from collections import Counter, deque
+from collections.abc import Mapping
+from contextlib import ExitStack
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import islice, tee
+from operator import itemgetter
+from datetime import date as calendar_date, datetime, timedelta
 from decimal import Decimal
 
 # https://www.bonify.de/abkuerzungen-im-verwendungszweck
@@ -25,178 +39,587 @@ DATE_NO_YEAR = r"(\d\d)\.(\d\d)\."
 DECIMAL = r"\d{1,3}(?:\.\d{3})*(?:,\d+)?"
 DECIMAL_FIXED_POINT = r"\d{1,3}(?:\.\d{3})*(?:,\d{2})"
 CURRENCY = r"AED|AFN|ALL|AMD|ANG|AOA|ARS|AUD|AWG|AZN|BAM|BBD|BDT|BGN|BHD|BIF|BMD|BND|BOB|BRL|BSD|BTN|BWP|BYR|BZD|CAD|CDF|CHF|CLP|CNY|COP|CRC|CUC|CUP|CVE|CZK|DJF|DKK|DOP|DZD|EGP|ERN|ETB|EUR|FJD|FKP|GBP|GEL|GGP|GHS|GIP|GMD|GNF|GTQ|GYD|HKD|HNL|HRK|HTG|HUF|IDR|ILS|IMP|INR|IQD|IRR|ISK|JEP|JMD|JOD|JPY|KES|KGS|KHR|KMF|KPW|KRW|KWD|KYD|KZT|LAK|LBP|LKR|LRD|LSL|LYD|MAD|MDL|MGA|MKD|MMK|MNT|MOP|MRO|MUR|MVR|MWK|MXN|MYR|MZN|NAD|NGN|NIO|NOK|NPR|NZD|OMR|PAB|PEN|PGK|PHP|PKR|PLN|PYG|QAR|RON|RSD|RUB|RWF|SAR|SBD|SCR|SDG|SEK|SGD|SHP|SLL|SOS|SPL|SRD|STD|SVC|SYP|SZL|THB|TJS|TMT|TND|TOP|TRY|TTD|TVD|TWD|TZS|UAH|UGX|USD|UYU|UZS|VEF|VND|VUV|WST|XAF|XCD|XDR|XOF|XPF|YER|ZAR|ZMW|ZWD"  # ISO 4217
+CURRENCIES = frozenset(CURRENCY.split("|"))
 TEXT = r"\S.*\S"
 SIGN = r"[\+\-SH]"
 CARD_NO = r"\b[0-9X]{4}\s[0-9X]{4}\s[0-9X]{4}\s[0-9X]{4}\b"
 BLANK = r"\s{3,}"
 MONTHS = dict(Januar=1, Februar=2, März=3, April=4, Mai=5, Juni=6, Juli=7, August=8, September=9, Oktober=10, November=11, Dezember=12)
 
-re_visa_filename = re.compile(
+
+class LazyPattern:
+    """A regular expression that is compiled when it is first used
+
+    A single statement needs only the patterns of its kind, compiling all of them took a good
+    part of the startup time. Once compiled, the methods of the compiled pattern are attributes
+    of the instance, so matching costs the same as with re.compile()."""
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.compile(), name)
+
+    def compile(self):
+        """compiles the pattern unless that happened before and returns the re.Pattern"""
+        compiled = self.__dict__.get("compiled")
+        if compiled is None:
+            compiled = re.compile(self.pattern, self.flags)
+            self.__dict__.update(
+                compiled=compiled, match=compiled.match, search=compiled.search, fullmatch=compiled.fullmatch,
+                finditer=compiled.finditer, findall=compiled.findall, sub=compiled.sub, split=compiled.split,
+                groups=compiled.groups, groupindex=compiled.groupindex,
+            )
+        return compiled
+
+
+def compile_patterns():
+    """compiles all patterns of the module ahead of their first use, e.g. before forking workers"""
+    for value in list(globals().values()):
+        for pattern in value if isinstance(value, list) else [value]:
+            if isinstance(pattern, LazyPattern):
+                pattern.compile()
+
+
+re_visa_filename = LazyPattern(
     r"Kreditkartenabrechnung_\d\d\d\d[_x]{8}\d\d\d\d_per_\d\d\d\d_\d\d_\d\d.pdf"
 )
 # Old format: Kontoauszug_1010001491_Nr_2015_004_per_2015_04_02.pdf
-re_filename_old = re.compile(
+re_filename_old = LazyPattern(
     r"Kontoauszug_\d{8,10}_Nr_\d\d\d\d_\d\d\d_per_\d\d\d\d_\d\d_\d\d.pdf"
 )
 # New format: Kontoauszug_8_2024_vom_05.08.2024_zu_Konto_1010001491.pdf
-re_filename_new = re.compile(
+re_filename_new = LazyPattern(
     r"Kontoauszug_\d{1,2}_\d\d\d\d_vom_\d\d\.\d\d[._]\d\d\d\d_?_?zu_Konto_\d{8,10}\.pdf"
 )
+# Account (or masked card number) and date encoded in the file names above, see filename_metadata
+re_filename_metadata = [
+    LazyPattern(r"Kreditkartenabrechnung_(?P<account>\d\d\d\d[_x]{8}\d\d\d\d)_per_(?P<year>\d\d\d\d)_(?P<month>\d\d)_(?P<day>\d\d)"),
+    LazyPattern(r"Kontoauszug_(?P<account>\d{8,10})_Nr_\d\d\d\d_\d\d\d_per_(?P<year>\d\d\d\d)_(?P<month>\d\d)_(?P<day>\d\d)"),
+    LazyPattern(r"Kontoauszug_\d{1,2}_\d\d\d\d_vom_(?P<day>\d\d)\.(?P<month>\d\d)[._](?P<year>\d\d\d\d)_?_?zu_Konto_(?P<account>\d{8,10})"),
+]
 # Combined pattern to match either old or new format
-re_filename = re.compile(
+re_filename = LazyPattern(
     r"Kontoauszug_(?:\d{8,10}_Nr_\d\d\d\d_\d\d\d_per_\d\d\d\d_\d\d_\d\d|\d{1,2}_\d\d\d\d_vom_\d\d\.\d\d[._]\d\d\d\d_?_?zu_Konto_\d{8,10})\.pdf"
 )
+# Any statement, the matching group tells VISA from bank statements
+re_statement_filename = LazyPattern(rf"(?P<visa>{re_visa_filename.pattern})|(?P<bank>{re_filename.pattern})")
 
 # Old format patterns
-re_range = re.compile(
+re_range = LazyPattern(
     rf"Kontoauszug Nummer (?P<no>\d*) / (?P<year>\d*) vom (?P<from>{DATE}) bis (?P<to>{DATE})"
 )
-re_account = re.compile(r"Kontonummer (?P<account>[0-9]*) / IBAN (?P<iban>[A-Z0-9 ]*)")
-re_balance_old = re.compile(
+re_account = LazyPattern(r"Kontonummer (?P<account>[0-9]*) / IBAN (?P<iban>[A-Z0-9 ]*)")
+re_balance_old = LazyPattern(
     rf"ALTER KONTOSTAND\s*(?P<old>{DECIMAL}) (?P<sign>{SIGN}) EUR"
 )
-re_balance_new = re.compile(
+re_balance_new = LazyPattern(
     rf"NEUER KONTOSTAND\s*(?P<new>{DECIMAL}) (?P<sign>{SIGN}) EUR"
 )
-re_table_header = re.compile(
+re_table_header = LazyPattern(
     r"(?P<booked>Bu.Tag)\s+(?P<valued>Wert)\s+(?P<comment>Wir haben für Sie gebucht)\s+(?P<minus>Belastung in EUR)\s+(?P<plus>Gutschrift in EUR)"
 )
-re_transaction = re.compile(
+re_transaction = LazyPattern(
     rf"^\s*(?P<booked>{DATE_NO_YEAR}){BLANK}"
     rf"(?P<valued>{DATE_NO_YEAR}){BLANK}"
     rf"(?P<type>{TEXT}){BLANK}"
     rf"(?P<value>{DECIMAL_FIXED_POINT})$"
 )
-re_transaction_details = re.compile(
+re_transaction_details = LazyPattern(
     rf"((?:{BLANK})|(?:{DATE_NO_YEAR}\s+{DATE_NO_YEAR}\s+))" rf"(?P<line>{TEXT})"
 )
 
 # New format patterns
-re_statement_new = re.compile(
+re_statement_new = LazyPattern(
     r"Kontoauszug (?P<no>\d{1,2})/(?P<year>\d{4})"
 )
-re_balance_old_new = re.compile(
-    rf"Kontostand am (?P<date>{DATE}), Auszug Nr\. \d+\s+(?P<old>{DECIMAL})"
+re_balance_old_new = LazyPattern(
+    rf"Kontostand am (?P<date>{DATE}), Auszug Nr\. \d+\s+(?P<old>-?{DECIMAL})"
 )
-re_balance_new_new = re.compile(
-    rf"Kontostand am (?P<date>{DATE}) um \d{2}:\d{2} Uhr\s+(?P<new>{DECIMAL})"
+re_balance_new_new = LazyPattern(
+    rf"Kontostand am (?P<date>{DATE}) um \d{{2}}:\d{{2}} Uhr\s+(?P<new>-?{DECIMAL})"
 )
-re_table_header_new = re.compile(
+re_table_header_new = LazyPattern(
     r"Datum\s+Erläuterung\s+Betrag Soll EUR\s+Betrag Haben EUR"
 )
-re_transaction_new_soll = re.compile(
-    r"^\s*(?P<booked>\d{2}\.\d{2}\.\d{4})\s+(?P<type>.+?)\s+(?P<soll>-?\d{1,3}(?:\.\d{3})*(?:,\d{2}))\s*$"
+# The type starts and ends with a non-blank, so every run of blanks can only be split one way
+# between the quantifiers around it and a failing line is rejected in linear time. A line
+# without a type is matched by the second branch, its type group is None.
+re_transaction_new_soll = LazyPattern(
+    r"^\s*(?P<booked>\d{2}\.\d{2}\.\d{4})(?:\s+(?P<type>\S(?:.*?\S)?)\s+|\s{3,})(?P<soll>-?\d{1,3}(?:\.\d{3})*(?:,\d{2}))\s*$"
 )
-re_transaction_new_haben = re.compile(
-    r"^\s*(?P<booked>\d{2}\.\d{2}\.\d{4})\s+(?P<type>.+?)\s{70,}(?P<haben>\d{1,3}(?:\.\d{3})*(?:,\d{2}))\s*$"
+re_transaction_new_haben = LazyPattern(
+    r"^\s*(?P<booked>\d{2}\.\d{2}\.\d{4})(?:\s+(?P<type>\S(?:.*?\S)?)\s{70,}|\s{72,})(?P<haben>\d{1,3}(?:\.\d{3})*(?:,\d{2}))\s*$"
 )
 
 # re_visa_table_header = re.compile(r"(?P<booked>Datum)\s+(?P<valued>Datum Angabe des Unternehmens /)\s+(?P<curency>Währung)\s+(?P<foreign_value>Betrag)\s+(?P<rate>Kurs)\s+(?P<value>Betrag in)")
-re_visa_balance_new = re.compile(
+re_visa_balance_new = LazyPattern(
     rf"\s*Neuer Saldo\s*(?P<value>{DECIMAL})\s*(?P<sign>{SIGN})?"
 )
-re_visa_balance_old = re.compile(
+re_visa_balance_old = LazyPattern(
     rf"\s*(?P<valued>{DATE})\s+Saldo letzte Abrechnung\s+(?P<value>{DECIMAL})\s*(?P<sign>{SIGN})"
 )
-re_visa_subtotal = re.compile(
-    rf"\s*(Zwischensumme|Übertrag von) Seite \d+\s+(?P<value>{DECIMAL})\s*(?P<sign>{SIGN})"
+re_visa_subtotal = LazyPattern(
+    rf"\s*(?P<kind>Zwischensumme|Übertrag von) Seite (?P<page>\d+)\s+(?P<value>{DECIMAL})\s*(?P<sign>{SIGN})"
 )
-re_visa_month_year = re.compile(r"\s+Abrechnung:\s+(?P<month>\b\S*\b) (?P<year>\d\d\d\d)")
+re_visa_month_year = LazyPattern(r"\s+Abrechnung:\s+(?P<month>\b\S*\b) (?P<year>\d\d\d\d)")
 
-re_visa_range = re.compile(rf"Ihre Abrechnung vom (?P<from>{DATE}) bis (?P<to>{DATE})")
+re_visa_range = LazyPattern(rf"Ihre Abrechnung vom (?P<from>{DATE}) bis (?P<to>{DATE})")
 
-re_visa_comment_extended = re.compile(r"^\s{18}(?P<comment_extended>\S.*)$")
+re_visa_comment_extended = LazyPattern(r"^\s{18}(?P<comment_extended>\S.*)$")
 
-re_visa_transaction_foreign = re.compile(
+# The currency is any three letter word here, a match only counts if it is in CURRENCIES. Trying
+# some 170 alternatives at every blank of a long comment made this the most expensive pattern.
+re_visa_transaction_foreign = LazyPattern(
     rf"^(?P<booked>{DATE})\s+"
     rf"(?P<valued>{DATE})\s+"
     rf"(?P<comment>{TEXT})\s+"
-    rf"(?P<currency>{CURRENCY})\s+"
+    rf"(?P<currency>[A-Z]{{3}})\s+"
     rf"(?P<foreign>{DECIMAL})\s+"
     rf"(?P<rate>{DECIMAL})\s+"
     rf"(?P<value>{DECIMAL})\s*"
     rf"(?P<sign>{SIGN})$"
 )
 
-re_visa_transaction = re.compile(
-    rf"^(?P<booked>{DATE})?\s+"
-    rf"(?P<valued>{DATE})?\s+"
+# Without a valued date, the blanks before the comment are matched by \s\s+ rather than \s+\s+,
+# which could split a long indentation in as many ways as it has blanks.
+re_visa_transaction = LazyPattern(
+    rf"^(?P<booked>{DATE})?"
+    rf"(?:\s+(?P<valued>{DATE})\s+|\s\s+)"
     rf"(?P<comment>{TEXT})\s+"
     rf"(?P<value>{DECIMAL})\s*"
     rf"(?P<sign>{SIGN})$"
 )
 
-re_visa_account = re.compile(
+re_visa_account = LazyPattern(
     rf".*((?:DKB-VISA-Card\:)|(?:VISA\sCard-Nummer\:))\s*(?P<account>{CARD_NO})"
 )
 # VISA Card-Nummer:
 # re_visa_owner = re.compile(r"\s*(?:Karteninhaber:)\s*(?P<owner>.*)")
 
 
-def transactions_to_csv(f, transactions):
-    """writes transactions as CSV to f"""
-    keys = ['account','year','statement','transaction','booked','valued','value','type','payee','comment']
-    transactions = sorted(transactions, key=lambda t: t["valued"], reverse=True)
-    dict_writer = csv.DictWriter(f, keys)
-    dict_writer.writeheader()
-    dict_writer.writerows(transactions)
+class Transaction(Mapping):
+    """A parsed transaction with native values, formatting is left to the writers
+
+    Item access returns the values as written to the CSV: the account zero-padded to 16 digits,
+    statement and transaction numbers as two and three digits."""
+
+    __slots__ = ("account", "year", "statement", "transaction", "booked", "valued", "type", "value", "payee", "comment")
+
+    def __init__(self, account, year, statement, transaction, booked, valued, type, value, payee="", comment=""):
+        self.account = account
+        self.year = year
+        self.statement = statement
+        self.transaction = transaction
+        self.booked = booked
+        self.valued = valued
+        self.type = type
+        self.value = value
+        self.payee = payee
+        self.comment = comment
+
+    def __getitem__(self, key):
+        if key == "account":
+            return f"{self.account:0>16}"
+        if key == "statement":
+            return f"{self.statement:02}"
+        if key == "transaction":
+            return f"{self.transaction:03}"
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __reduce__(self):
+        return Transaction, tuple(getattr(self, key) for key in self.__slots__)
+
+    def __repr__(self):
+        return f"Transaction({', '.join(repr(getattr(self, key)) for key in self.__slots__)})"
+
+
+# number of transactions sorted in memory before sorted runs are spilled to temporary files
+SORT_BUFFER = 100000
+
+
+def valued_key(transaction):
+    return transaction["valued"]
+
+
+def read_run(f):
+    """yields the transactions of a sorted run written by sort_transactions"""
+    import pickle
+    f.seek(0)
+    while True:
+        try:
+            chunk = pickle.load(f)
+        except EOFError:
+            return
+        yield from chunk
+
+
+def sort_transactions(transactions, buffer_size=SORT_BUFFER):
+    """yields transactions sorted by value date (newest first), same order as sorted()
+
+    At most buffer_size transactions are kept in memory, larger inputs are sorted in runs that are
+    spilled to temporary files and merged."""
+    runs = []
+    buffer = []
+    try:
+        for transaction in transactions:
+            buffer.append(transaction)
+            if len(buffer) >= buffer_size:
+                import pickle
+                import tempfile
+                buffer.sort(key=valued_key, reverse=True)
+                run = tempfile.TemporaryFile()
+                for i in range(0, len(buffer), 1024):
+                    pickle.dump(buffer[i:i + 1024], run, pickle.HIGHEST_PROTOCOL)
+                runs.append(run)
+                buffer = []
+        buffer.sort(key=valued_key, reverse=True)
+        if not runs:
+            yield from buffer
+            return
+        # heapq.merge prefers earlier runs on equal keys, which keeps the sort stable
+        yield from heapq.merge(*map(read_run, runs), buffer, key=valued_key, reverse=True)
+    finally:
+        for run in runs:
+            run.close()
+
+
+WRITE_BATCH = 1000
+
+
+class DkbCsvSink:
+    """writes transactions as CSV in the original format"""
+
+    fieldnames = ['account','year','statement','transaction','booked','valued','value','type','payee','comment']
+    row = staticmethod(itemgetter(*fieldnames))
+
+    def __init__(self, f):
+        self.writer = csv.writer(f)
+
+    def __enter__(self):
+        self.writer.writerow(self.fieldnames)
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def write(self, transactions):
+        self.writer.writerows(map(self.row, transactions))
+
+
+class MoneyMoneyCsvSink(DkbCsvSink):
+    """writes transactions as MoneyMoney CSV"""
 
-def transactions_to_moneymoney_csv(f, transactions):
-    """writes transactions as MoneyMoney CSV to f"""
     # MoneyMoney CSV format:
     # Datum;Wertstellung;Kategorie;Name;Verwendungszweck;Konto;Bank;Betrag;Währung
     fieldnames = ['Datum', 'Wertstellung', 'Kategorie', 'Name', 'Verwendungszweck', 'Konto', 'Bank', 'Betrag', 'Währung']
 
-    writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-    writer.writeheader()
+    def __init__(self, f):
+        self.writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+
+    @staticmethod
+    def row(transaction):
+        # Kategorie is not available in DKB statements. For VISA transactions the card is the
+        # other party, with masked digits. MoneyMoney expects negative amounts for expenses and
+        # positive ones for income, which DKB already follows.
+        visa = transaction['type'] == 'VISA'
+        return (
+            german_date(transaction['booked']),
+            german_date(transaction['valued']),
+            '',
+            transaction['payee'] or transaction['type'],
+            transaction.get('comment', ''),
+            transaction['account'].replace('X', '*') if visa else '',
+            'VISA' if visa else '',
+            german_amount(transaction['value']),
+            'EUR',
+        )
 
-    # Sort by value date (newest first)
-    transactions = sorted(transactions, key=lambda t: t["valued"], reverse=True)
 
-    for transaction in transactions:
-        # Extract account info from transaction for the OTHER party
-        other_account = ""
-        other_bank = ""
+class JsonSink(DkbCsvSink):
+    """writes transactions as a JSON array of objects with the fields of the original CSV format"""
+
+    def __init__(self, f):
+        self.f = f
+        self.separator = "\n"
+
+    def __enter__(self):
+        self.f.write("[")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.f.write("\n]\n")
+
+    def write(self, transactions):
+        import json
+        rows = []
+        for transaction in transactions:
+            row = dict(zip(self.fieldnames, self.row(transaction)))
+            rows.append(self.separator + json.dumps(row, default=str, ensure_ascii=False))
+            self.separator = ",\n"
+        self.f.write("".join(rows))
+
+
+def write_transactions(sinks, transactions, sort=True, buffer_size=SORT_BUFFER, batch_size=WRITE_BATCH):
+    """writes transactions to all sinks in one pass, newest first unless sort is False
+
+    Transactions are sorted once and handed to the sinks in batches of batch_size."""
+    if sort:
+        transactions = sort_transactions(transactions, buffer_size)
+    transactions = iter(transactions)
+    with ExitStack() as stack:
+        for sink in sinks:
+            stack.enter_context(sink)
+        while True:
+            batch = list(islice(transactions, batch_size))
+            if not batch:
+                break
+            for sink in sinks:
+                sink.write(batch)
+
+
+def transactions_to_csv(f, transactions, sort=True, buffer_size=SORT_BUFFER):
+    """writes transactions as CSV to f, newest first unless sort is False"""
+    write_transactions([DkbCsvSink(f)], transactions, sort, buffer_size)
+
+def transactions_to_moneymoney_csv(f, transactions, sort=True, buffer_size=SORT_BUFFER):
+    """writes transactions as MoneyMoney CSV to f, newest first unless sort is False"""
+    write_transactions([MoneyMoneyCsvSink(f)], transactions, sort, buffer_size)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    account TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    statement INTEGER NOT NULL,
+    file TEXT,
+    iban TEXT,
+    date_from TEXT,
+    date_to TEXT,
+    balance_old_cents INTEGER,
+    balance_new_cents INTEGER,
+    PRIMARY KEY (account, year, statement)
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    account TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    statement INTEGER NOT NULL,
+    "transaction" INTEGER NOT NULL,
+    booked TEXT NOT NULL,
+    valued TEXT NOT NULL,
+    value_cents INTEGER NOT NULL,
+    type TEXT,
+    payee TEXT,
+    comment TEXT,
+    PRIMARY KEY (account, year, statement, "transaction")
+);
+-- the primary key indexes serve lookups by account
+CREATE INDEX IF NOT EXISTS transactions_valued ON transactions (valued);
+CREATE INDEX IF NOT EXISTS transactions_booked ON transactions (booked);
+CREATE INDEX IF NOT EXISTS transactions_payee ON transactions (payee);
+"""
+
+
+def cents(value):
+    return None if value is None else int(Decimal(value) * 100)
+
+
+def statement_row(statement):
+    """returns the statements table row of a statement summary, None if it lacks its natural key"""
+    if not all(key in statement for key in ("account", "year", "no")):
+        return None
+    isoformat = lambda key: statement[key].isoformat() if key in statement else None
+    return (
+        f"{''.join(statement['account'].split()):0>16}", int(statement["year"]), statement["no"],
+        statement.get("file"), statement.get("iban"), isoformat("from"), isoformat("to"),
+        cents(statement.get("balance_old")), cents(statement.get("balance_new")),
+    )
 
-        # Try to extract account/bank info from comment if available
-        comment = transaction.get('comment', '')
-        if 'Referenz:' in comment:
-            # This might contain bank info in some cases
-            pass
 
-        # For VISA transactions, the original account is the source
-        if transaction['type'] == 'VISA':
-            other_account = transaction['account'].replace('X', '*')  # Mask some digits for privacy
-            other_bank = "VISA"
-
-        # Format dates
-        booked_date = transaction['booked'].strftime('%d.%m.%Y')
-        valued_date = transaction['valued'].strftime('%d.%m.%Y')
-
-        # Amount - negative for expenses, positive for income
-        amount = transaction['value']
-
-        # MoneyMoney expects negative amounts for expenses (Ausgaben)
-        # and positive for income (Einnahmen)
-        # DKB already follows this convention
-
-        writer.writerow({
-            'Datum': booked_date,
-            'Wertstellung': valued_date,
-            'Kategorie': '',  # Not available in DKB statements
-            'Name': transaction['payee'] or transaction['type'],
-            'Verwendungszweck': comment,
-            'Konto': other_account,
-            'Bank': other_bank,
-            'Betrag': f"{amount:.2f}".replace('.', ','),  # German decimal format
-            'Währung': 'EUR'
-        })
+class SqliteSink:
+    """writes transactions and statements into the SQLite database at path
+
+    Rows replace those with the same natural key, so loading statements again updates them.
+    Everything is written in one database transaction. statements are written on exit, so they
+    may be collected while transactions are consumed."""
+
+    def __init__(self, path, statements=()):
+        self.path = path
+        self.statements = statements
+
+    def __enter__(self):
+        import sqlite3
+        self.connection = sqlite3.connect(self.path)
+        try:
+            self.connection.executescript(SQLITE_SCHEMA)
+        except BaseException:
+            self.connection.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                rows = [row for row in map(statement_row, self.statements) if row is not None]
+                self.connection.executemany("INSERT OR REPLACE INTO statements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.connection.close()
+
+    def write(self, transactions):
+        rows = [
+            (
+                t["account"], int(t["year"]), int(t["statement"]), int(t["transaction"]),
+                t["booked"].isoformat(), t["valued"].isoformat(), cents(t["value"]),
+                t["type"], t["payee"], t["comment"],
+            )
+            for t in transactions
+        ]
+        self.connection.executemany("INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def transactions_to_sqlite(path, transactions, statements=(), batch_size=WRITE_BATCH):
+    """writes transactions and statements into the SQLite database at path, see SqliteSink"""
+    write_transactions([SqliteSink(path, statements)], transactions, sort=False, batch_size=batch_size)
+
+
+SINKS = {
+    'dkb': DkbCsvSink,
+    'json': JsonSink,
+    'moneymoney': MoneyMoneyCsvSink,
+    'sqlite': SqliteSink,
+}
+
+def partition_key(transaction):
+    """returns the (kind, account, year) partition of a transaction, see PartitionedOutput"""
+    return ("visa" if transaction["type"] == "VISA" else "bank", transaction["account"], str(transaction["year"]))
+
+
+class PartitionedOutput:
+    """Writes transactions into one file per statement kind, account and year below a directory
+
+    Files are named <kind>/<account>/<year>.<extension> and listed in index.json with their row
+    count, value date range, SHA-256 checksum and a fingerprint of the statement files they were
+    written from. settings stands for everything else that changes the content, like filters.
+    Partitions whose fingerprint did not change since the last run are not written again, files
+    of partitions that are gone are removed. The settings are kept in the index, a run with other
+    settings would remove or shrink partitions it did not look at, see check_settings."""
+
+    INDEX = "index.json"
+    EXTENSIONS = {"dkb": "csv", "moneymoney": "csv", "json": "json"}
+
+    def __init__(self, directory, format="dkb", settings=""):
+        self.directory = directory
+        self.format = format
+        self.settings = settings
+        self.partitions = {}  # (kind, account, year) -> transactions
+        self.sources = {}  # (kind, account, year) -> digests of the statement files
+
+    def add(self, transactions, statement):
+        """adds the transactions parsed from statement"""
+        digest = file_digest(statement["file"])
+        for transaction in transactions:
+            key = partition_key(transaction)
+            if key not in self.partitions:
+                self.partitions[key] = []
+                self.sources[key] = set()
+            self.partitions[key].append(transaction)
+            self.sources[key].add(digest)
+
+    def fingerprint(self, key):
+        import hashlib
+        sha256 = hashlib.sha256(f"{PARSER_VERSION} {self.format} {self.settings}".encode())
+        for digest in sorted(self.sources[key]):
+            sha256.update(digest.encode())
+        return sha256.hexdigest()
+
+    def read_index(self):
+        """returns the settings and the index entries by path of the last run, None and {} if there was none"""
+        import json
+        try:
+            with open(os.path.join(self.directory, self.INDEX)) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return None, {}
+        return index.get("settings"), {entry["path"]: entry for entry in index["partitions"]}
+
+    def check_settings(self):
+        """returns False if the directory was written with other settings before"""
+        settings, _ = self.read_index()
+        return settings is None or settings == self.settings
+
+    def write(self, jobs=1):
+        """writes changed partitions with jobs threads, removes vanished ones and writes the index
+
+        Returns the number of partitions that were written."""
+        import json
+        from concurrent.futures import ThreadPoolExecutor
+        _, old = self.read_index()
+        entries = []
+        changed = []
+        for key in sorted(self.partitions):
+            kind, account, year = key
+            path = f"{kind}/{account}/{year}.{self.EXTENSIONS[self.format]}"
+            fingerprint = self.fingerprint(key)
+            entry = old.get(path)
+            if entry and entry["fingerprint"] == fingerprint and os.path.exists(os.path.join(self.directory, path)):
+                entries.append(entry)
+            else:
+                changed.append((key, path, fingerprint))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            entries.extend(executor.map(lambda args: self.write_partition(*args), changed))
+        for path in old.keys() - {entry["path"] for entry in entries}:
+            try:
+                os.remove(os.path.join(self.directory, path))
+            except FileNotFoundError:
+                pass
+        entries.sort(key=lambda entry: entry["path"])
+        index = os.path.join(self.directory, self.INDEX)
+        with open(f"{index}.tmp", "w") as f:
+            json.dump({"version": 1, "format": self.format, "settings": self.settings, "partitions": entries}, f, indent=1, sort_keys=True)
+        os.replace(f"{index}.tmp", index)
+        return len(changed)
+
+    def write_partition(self, key, path, fingerprint):
+        """writes one partition, newest first, and returns its index entry"""
+        import hashlib
+        transactions = sorted(self.partitions[key], key=valued_key, reverse=True)
+        f = io.StringIO()
+        write_transactions([SINKS[self.format](f)], transactions, sort=False)
+        data = f.getvalue().encode()
+        filename = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(f"{filename}.tmp", "wb") as out:
+            out.write(data)
+        os.replace(f"{filename}.tmp", filename)
+        kind, account, year = key
+        return {
+            "path": path, "kind": kind, "account": account, "year": year, "rows": len(transactions),
+            "valued_from": transactions[-1]["valued"].isoformat(), "valued_to": transactions[0]["valued"].isoformat(),
+            "sha256": hashlib.sha256(data).hexdigest(), "fingerprint": fingerprint,
+        }
+
 
 def csv_to_transactions(f):
     """Reads transactions as CSV from f"""
-    Date = lambda s: datetime.strptime(s, '%Y-%m-%d').date()
-    decimal_accuracy = Decimal('0.01')
-    converters={'valued': Date, 'booked': Date, 'value': lambda s: Decimal(s).quantize(decimal_accuracy)}
+    converters={'valued': iso_date, 'booked': iso_date, 'value': cents_decimal}
     reader = csv.DictReader(f)
     transactions = []
     for row in reader:
@@ -205,63 +628,1317 @@ def csv_to_transactions(f):
         transactions.append(row)
     return transactions
 
-def scan_dirs(dirpaths):
-    """Recursively scans dirpath for DKB bank or visa statements and returns all parsed transactions and statements"""
+def transaction_key(transaction):
+    """returns the (account, year, statement, transaction) key that identifies a transaction"""
+    return (transaction["account"], str(transaction["year"]), transaction["statement"], transaction["transaction"])
+
+def merge_transactions(*transaction_lists):
+    """merges transaction lists, transactions of later lists replace those with the same key in earlier ones"""
+    merged = {}
+    for transactions in transaction_lists:
+        for transaction in transactions:
+            merged[transaction_key(transaction)] = transaction
+    return list(merged.values())
+
+def json_to_transactions(f):
+    """Reads transactions as written by the json format from f"""
+    import json
+    converters={'valued': iso_date, 'booked': iso_date, 'value': cents_decimal}
+    transactions = json.load(f)
+    for row in transactions:
+        for key, func in converters.items():
+            row[key] = func(str(row[key]))
+    return transactions
+
+def moneymoney_csv_to_transactions(f):
+    """Reads transactions as MoneyMoney CSV from f
+
+    MoneyMoney CSV has no statement numbers and no type, and the account only for VISA
+    transactions, these fields are left empty."""
+    reader = csv.DictReader(f, delimiter=';')
+    transactions = []
+    for row in reader:
+        visa = row['Bank'] == 'VISA'
+        transactions.append({
+            'account': row['Konto'].replace('*', 'X') if visa else '', 'year': '', 'statement': '', 'transaction': '',
+            'booked': german_to_date(row['Datum']), 'valued': german_to_date(row['Wertstellung']),
+            'value': decimal(row['Betrag']).quantize(Decimal("0.01")), 'type': 'VISA' if visa else '',
+            'payee': row['Name'], 'comment': row['Verwendungszweck'],
+        })
+    return transactions
+
+EXPORT_READERS = {"dkb": csv_to_transactions, "json": json_to_transactions, "moneymoney": moneymoney_csv_to_transactions}
+
+def export_format(first_line):
+    """returns the format of an export, dkb, json or moneymoney, from its first line"""
+    if first_line.lstrip().startswith("["):
+        return "json"
+    if first_line.startswith("Datum;"):
+        return "moneymoney"
+    return "dkb"
+
+def read_export(path):
+    """reads the transactions of a DKB CSV, JSON or MoneyMoney CSV export, - reads stdin"""
+    with io.StringIO(sys.stdin.read()) if path == "-" else open(path, newline='') as f:
+        format = export_format(f.readline())
+        f.seek(0)
+        return EXPORT_READERS[format](f)
+
+def normalize_text(s):
+    """returns s without any whitespace
+
+    Comments are joined from lines with a space in between, and pdftotext may drop or add spaces
+    within a line, so the same comment can differ in whitespace between two parses."""
+    return "".join(s.split())
+
+def transaction_fingerprint(transaction, account=None):
+    """returns a stable hex digest of the account, dates, value, payee and comment of a transaction
+
+    Payee and comment are compared without whitespace, and a missing payee is replaced by the type
+    as in MoneyMoney CSV. The statement and transaction numbers are left out, MoneyMoney CSV lacks them.
+    Pass account to replace the account of the transaction."""
+    import hashlib
+    fields = (
+        normalize_account(transaction["account"]) if account is None else account,
+        transaction["booked"].isoformat(),
+        transaction["valued"].isoformat(),
+        f"{transaction['value']:.2f}",
+        normalize_text(transaction["payee"] or transaction["type"]),
+        normalize_text(transaction["comment"]),
+    )
+    return hashlib.sha1("\x1f".join(fields).encode()).hexdigest()
+
+class MergedExports:
+    """Union of the transactions of several exports, duplicates are found by fingerprint in a hash index
+
+    The n-th transaction with a fingerprint in one export is the same as the n-th one with that
+    fingerprint in any other, so that identical transactions of one day are kept apart. Rows
+    without an account, bank transactions from MoneyMoney CSV, are duplicates of rows with the same
+    fingerprint apart from the account. Of duplicates, the row with the account and statement
+    numbers is kept. Rows of different exports with the same account, year, statement and
+    transaction number but a different fingerprint are conflicts, the row of the later export
+    replaces the earlier one."""
+
+    def __init__(self):
+        self.names = []  # names of the exports added
+        self.transactions = {}  # (fingerprint, n) -> transaction
+        self.sources = {}  # (fingerprint, n) -> index in names of the export the transaction is from
+        self.keys = {}  # transaction_key -> (fingerprint, n)
+        self.content = {}  # (fingerprint without the account, n) -> (fingerprint, n) of rows with an account
+        self.duplicates = 0
+        self.conflicts = []
+
+    def add(self, transactions, name):
+        """adds the transactions of the export name and returns the conflicts found"""
+        source = len(self.names)
+        self.names.append(name)
+        conflicts = []
+        seen = Counter()
+        seen_content = Counter()
+        for transaction in transactions:
+            fingerprint = transaction_fingerprint(transaction)
+            seen[fingerprint] += 1
+            entry = (fingerprint, seen[fingerprint])
+            content_entry = None
+            if normalize_account(transaction["account"]):
+                content = transaction_fingerprint(transaction, account="")
+                seen_content[content] += 1
+                content_entry = (content, seen_content[content])
+            if entry in self.transactions:
+                duplicate = entry
+            elif content_entry in self.transactions:
+                duplicate = content_entry
+            elif content_entry is None and self.content.get(entry) in self.transactions:
+                duplicate = self.content[entry]
+            else:
+                duplicate = None
+            if duplicate:
+                self.duplicates += 1
+                if not transaction["statement"] or self.transactions[duplicate]["statement"]:
+                    continue
+                self.remove(duplicate)
+            if transaction["statement"]:
+                key = transaction_key(transaction)
+                previous = self.keys.get(key)
+                if previous in self.transactions and self.sources[previous] != source:
+                    conflicts.append(self.conflict(key, previous, transaction, name))
+                    self.remove(previous)
+                self.keys[key] = entry
+            self.transactions[entry] = transaction
+            self.sources[entry] = source
+            if content_entry:
+                self.content[content_entry] = entry
+        self.conflicts += conflicts
+        return conflicts
+
+    def remove(self, entry):
+        del self.transactions[entry]
+        del self.sources[entry]
+
+    def conflict(self, key, previous, transaction, name):
+        """returns a message naming the fields in which transaction differs from the one at previous"""
+        old = self.transactions[previous]
+        # the fields of the fingerprint, normalized the same way
+        normalized = {"account": normalize_account, "booked": str, "valued": str, "value": str, "type": str, "payee": normalize_text, "comment": normalize_text}
+        fields = [field for field, normalize in normalized.items() if normalize(old[field]) != normalize(transaction[field])]
+        account, year, statement, no = key
+        return f"{normalize_account(account)} statement {statement}/{year} transaction {no} differs between {self.names[self.sources[previous]]} and {name}: {', '.join(fields)}"
+
+# bump whenever a change to the parsers changes their results, this invalidates cached statements
+PARSER_VERSION = 3
+
+
+class StatementCache:
+    """On-disk cache for pdftotext output and parsed statements
+
+    The text tier is keyed by the PDF content hash and the extractor version, the parsed tier by
+    the text hash, the reader and PARSER_VERSION. Entries are evicted least recently used first
+    once the cache grows beyond max_size bytes."""
+
+    def __init__(self, path, max_size=256 * 1024 * 1024, backend="pdftotext"):
+        self.path = path
+        self.max_size = max_size
+        self.backend = backend
+        self.hits = Counter()
+        self.misses = Counter()
+        for tier in ("text", "parsed"):
+            os.makedirs(os.path.join(path, tier), exist_ok=True)
+
+    def _entry(self, tier, *parts):
+        import hashlib
+        key = hashlib.sha256("\0".join(parts).encode()).hexdigest()
+        return os.path.join(self.path, tier, key)
+
+    def _load(self, tier, entry):
+        try:
+            with open(entry, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses[tier] += 1
+            return None
+        os.utime(entry)  # mark as recently used
+        self.hits[tier] += 1
+        return data
+
+    def _store(self, entry, data):
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, entry)
+
+    def _text_entry(self, pdf):
+        return self._entry("text", file_digest(pdf), get_extractor(self.backend).version())
+
+    def _parsed_entry(self, reader, table):
+        import hashlib
+        digest = hashlib.sha256(table.encode()).hexdigest()
+        return self._entry("parsed", digest, reader.__name__, str(PARSER_VERSION))
+
+    def get_table(self, pdf):
+        """returns the cached pdftotext output for pdf or None"""
+        data = self._load("text", self._text_entry(pdf))
+        return data.decode() if data is not None else None
+
+    def put_table(self, pdf, table):
+        self._store(self._text_entry(pdf), table.encode())
+
+    def get_statement(self, reader, pdf, table):
+        """returns the cached (transactions, statement) parsed by reader from table or None"""
+        data = self._load("parsed", self._parsed_entry(reader, table))
+        if data is None:
+            return None
+        import pickle
+        transactions, statement = pickle.loads(data)
+        statement["file"] = pdf  # the same content may have been parsed under another name
+        return transactions, statement
+
+    def put_statement(self, reader, table, result):
+        import pickle
+        self._store(self._parsed_entry(reader, table), pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+
+    def trim(self):
+        """evicts least recently used entries until the cache fits into max_size"""
+        entries = []
+        for tier in ("text", "parsed"):
+            with os.scandir(os.path.join(self.path, tier)) as it:
+                entries.extend(entry for entry in it if entry.is_file())
+        stats = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries]
+        size = sum(s for _, s, _ in stats)
+        for mtime, entry_size, path in sorted(stats):
+            if size <= self.max_size:
+                break
+            os.remove(path)
+            size -= entry_size
+
+    def summary(self):
+        return ", ".join(
+            f"{tier} {self.hits[tier]} hits / {self.misses[tier]} misses" for tier in ("text", "parsed")
+        )
+
+
+class Manifest:
+    """Records the statement files that were processed into an output, keyed by absolute path
+
+    settings describe what was written of every file, e.g. the filters of the run. Files that
+    were processed with other settings may be missing transactions, so the records are dropped
+    when the settings change."""
+
+    def __init__(self, path, settings=""):
+        self.path = path
+        self.settings = settings
+        self.files = {}
+        if os.path.exists(path):
+            import json
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("settings", "") == settings:
+                self.files = data["files"]
+
+    def is_processed(self, pdf):
+        """returns True if pdf was processed before and did not change since"""
+        entry = self.files.get(os.path.abspath(pdf))
+        if entry is None:
+            return False
+        stat = os.stat(pdf)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return True
+        # touched or copied again, only the content counts
+        if entry["size"] == stat.st_size and entry["sha256"] == file_digest(pdf):
+            entry["mtime"] = stat.st_mtime
+            return True
+        return False
+
+    def add(self, pdf):
+        stat = os.stat(pdf)
+        self.files[os.path.abspath(pdf)] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_digest(pdf)}
+
+    def save(self):
+        import json
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": 1, "settings": self.settings, "files": self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class BalanceIndex:
+    """Statement summaries keyed by account, year and statement number, persisted as JSON at path
+
+    The statements of an account form a chain: the old balance of every statement is the new
+    balance of the one before it, and bank statements are numbered from 1 in every year. VISA
+    statements are numbered by month, but months without a statement are not gaps. check()
+    walks every chain once, in order, starting where the last check ended, so a run that adds
+    this month's statements checks only those. Statements inserted before that point, e.g. when
+    a gap is filled, move it back to them, and so do statements whose file is gone, which are
+    dropped. Problems are only reported for statements below the roots given, the directories of
+    the run. The index starts over when PARSER_VERSION changes, and it is not persisted if path
+    is None."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.accounts = {}
+        if path and os.path.exists(path):
+            import json
+            with open(path) as f:
+                index = json.load(f)
+            if index.get("parser_version") == PARSER_VERSION:
+                self.accounts = index["accounts"]
+
+    def update(self, statements):
+        """adds or replaces the summaries of statements, dicts as returned by scan_dirs, and drops those of removed files"""
+        for account, chain in list(self.accounts.items()):
+            entries = chain["statements"]
+            for i in reversed(range(len(entries))):
+                if not os.path.exists(entries[i][4]):
+                    self.move_checked(chain, entries[i][:2], i)
+                    del entries[i]
+            if not entries:
+                del self.accounts[account]
+        for statement in statements:
+            if not {"account", "year", "no"} <= statement.keys():
+                continue
+            chain = self.accounts.setdefault(normalize_account(statement["account"]), {
+                "kind": "visa" if "month" in statement else "bank", "statements": [], "checked": None, "problems": [],
+            })
+            # [year, no, balance_old in cents, balance_new in cents, file], sorted by year and no
+            entries = chain["statements"]
+            key = [statement["year"], statement["no"]]
+            entry = key + [cents(statement.get("balance_old")), cents(statement.get("balance_new")), os.path.abspath(statement["file"])]
+            i = bisect_left(entries, key)
+            if i < len(entries) and entries[i][:2] == key:
+                unchanged = entries[i][2:4] == entry[2:4]
+                entries[i] = entry
+                if unchanged:
+                    continue  # at most moved to another file
+            else:
+                entries.insert(i, entry)
+            self.move_checked(chain, key, i)
+
+    @staticmethod
+    def move_checked(chain, key, i):
+        """moves the end of the last check of chain before key, the statement at index i, if it is not already"""
+        if chain["checked"] is not None and key <= chain["checked"]:
+            chain["checked"] = chain["statements"][i - 1][:2] if i else None
+
+    @staticmethod
+    def below(pdf, roots):
+        """returns True if roots is None or pdf, an absolute path, is below one of the roots"""
+        return roots is None or any(pdf.startswith(os.path.join(os.path.abspath(root), "")) for root in roots)
+
+    def check(self, roots=None):
+        """checks every chain from where the last check ended, returns the problems found below roots"""
+        found = []
+        for account, chain in sorted(self.accounts.items()):
+            entries = chain["statements"]
+            checked = chain["checked"]
+            # problems are stored as [year, no, message] of the later statement of the link
+            chain["problems"] = [problem for problem in chain["problems"] if checked is not None and problem[:2] <= checked]
+            start = bisect_left(entries, checked) + 1 if checked is not None else 1
+            for previous, entry in zip(entries[start - 1:], entries[start:]):
+                for message in self.link_problems(chain["kind"], previous, entry):
+                    chain["problems"].append(entry[:2] + [f"{account}: {message}"])
+                    if self.below(entry[4], roots):
+                        found.append(f"{account}: {message}")
+            if entries:
+                chain["checked"] = entries[-1][:2]
+        return found
+
+    @staticmethod
+    def link_problems(kind, previous, entry):
+        """returns the problems between two consecutive statements of a chain"""
+        year, no, old, _, pdf = entry
+        previous_year, previous_no, _, previous_new, previous_pdf = previous
+        problems = []
+        if kind == "bank" and [year, no] not in ([previous_year, previous_no + 1], [previous_year + 1, 1]):
+            problems.append(f"statement {no}/{year} follows {previous_no}/{previous_year}, statements are missing before {pdf}")
+        if old is not None and previous_new is not None and old != previous_new:
+            problems.append(
+                f"old balance {Decimal(old) / 100:.2f} of {pdf} does not carry over the new balance "
+                f"{Decimal(previous_new) / 100:.2f} of {previous_pdf}"
+            )
+        return problems
+
+    def problems(self, accept=None, roots=None):
+        """returns all problems that were found and not resolved since, of the accounts accept(account) is true for
+
+        Only problems of statements below roots are returned, the problems of a link belong to its
+        later statement."""
+        found = []
+        for account, chain in sorted(self.accounts.items()):
+            if accept is not None and not accept(account):
+                continue
+            entries = chain["statements"]
+            for year, no, message in chain["problems"]:
+                i = bisect_left(entries, [year, no])
+                if self.below(entries[i][4], roots):
+                    found.append(message)
+        return found
+
+    def save(self):
+        if not self.path:
+            return
+        import json
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": 1, "parser_version": PARSER_VERSION, "accounts": self.accounts}, f, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def normalize_account(account):
+    """returns an account or card number without spaces and leading zeros, masked digits as X"""
+    return "".join(account.split()).upper().lstrip("0")
+
+
+def account_matches(account, wanted):
+    """compares normalized account numbers, X in either one matches any digit"""
+    return len(account) == len(wanted) and all(a == w or "X" in (a, w) for a, w in zip(account, wanted))
+
+
+class StatementFilter:
+    """Restricts a run to transactions valued between since and until and to some accounts
+
+    accepts_file decides on the file name before anything is extracted. Transactions of a
+    statement may be valued some days after its date, and long before it (card payments, late
+    bookings), so file names are only used to skip statements that are clearly out of range.
+    Files whose names carry no metadata are always parsed. accepts then applies the exact
+    restriction to every transaction, and accepts_account to an account."""
+
+    # how far transaction value dates may lie after and before the date in a statement file name
+    SLACK_AFTER = timedelta(days=14)
+    SLACK_BEFORE = timedelta(days=100)
+
+    def __init__(self, since=None, until=None, accounts=()):
+        self.since = since
+        self.until = until
+        self.accounts = [normalize_account(account) for account in accounts]
+
+    def __bool__(self):
+        return bool(self.since or self.until or self.accounts)
+
+    def accepts_account(self, account):
+        """returns True if account, with or without spaces and leading zeros, passes the filter"""
+        account = normalize_account(account)
+        return not self.accounts or any(account_matches(account, wanted) for wanted in self.accounts)
+
+    def accepts_file(self, pdf):
+        metadata = filename_metadata(pdf)
+        if metadata is None:
+            return True
+        if not self.accepts_account(metadata["account"]):
+            return False
+        if self.since and metadata["date"] + self.SLACK_AFTER < self.since:
+            return False
+        if self.until and metadata["date"] - self.SLACK_BEFORE > self.until:
+            return False
+        return True
+
+    def accepts(self, transaction):
+        valued = transaction["valued"]
+        if self.since and valued < self.since:
+            return False
+        if self.until and valued > self.until:
+            return False
+        return self.accepts_account(transaction["account"])
+
+
+class FileStats:
+    """Timings and counters collected while one statement file is extracted and parsed"""
+
+    def __init__(self, pdf, cached=False):
+        self.file = pdf
+        self.cached = cached
+        self.pdftotext = 0.0
+        self.parse = 0.0
+        self.pdf_bytes = 0
+        self.text_bytes = 0
+        self.lines = 0
+        self.not_matched = 0
+        self.balance = None
+        self.patterns = {}  # pattern name -> [attempts, hits, seconds]
+
+    def set_table(self, table):
+        self.pdf_bytes = os.path.getsize(self.file)
+        self.text_bytes = len(table.encode())
+        self.lines = table.count("\n")
+
+    def check_match(self, re, line, result):
+        """instrumented version of check_match"""
+        start = time.perf_counter()
+        match = re.match(line)
+        elapsed = time.perf_counter() - start
+        counters = self.patterns.setdefault(pattern_name(re), [0, 0, 0.0])
+        counters[0] += 1
+        counters[2] += elapsed
+        if match:
+            counters[1] += 1
+            result["match"] = match
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("'%s'\t%s\t%s", line, match.groupdict(), re.pattern)
+        return match
+
+
+class RunStats:
+    """Collects FileStats of a run and reports them per file and in total"""
+
+    def __init__(self):
+        self.files = []
+        self.write = 0.0
+
+    def add(self, file_stats):
+        self.files.append(file_stats)
+
+    def patterns(self):
+        patterns = {}
+        for file_stats in self.files:
+            for name, (attempts, hits, seconds) in file_stats.patterns.items():
+                counters = patterns.setdefault(name, [0, 0, 0.0])
+                counters[0] += attempts
+                counters[1] += hits
+                counters[2] += seconds
+        return patterns
+
+    def totals(self):
+        totals = {"files": len(self.files), "cached": sum(f.cached for f in self.files)}
+        for key in ("pdftotext", "parse", "pdf_bytes", "text_bytes", "lines", "not_matched"):
+            totals[key] = sum(getattr(f, key) for f in self.files)
+        totals["write"] = self.write
+        totals["balance"] = Counter(f.balance for f in self.files)
+        return totals
+
+    def to_json(self, f):
+        import json
+        files = [
+            {key: value for key, value in vars(file_stats).items() if key != "patterns"}
+            | {"patterns": {name: dict(zip(("attempts", "hits", "seconds"), c)) for name, c in file_stats.patterns.items()}}
+            for file_stats in self.files
+        ]
+        patterns = {name: dict(zip(("attempts", "hits", "seconds"), c)) for name, c in self.patterns().items()}
+        json.dump({"files": files, "total": self.totals(), "patterns": patterns}, f, indent=1)
+        f.write("\n")
+
+    def to_table(self, f):
+        row = "{:<60} {:>6} {:>10} {:>8} {:>9} {:>7} {:>9} {:<8}\n"
+        f.write(row.format("file", "cached", "pdftotext", "parse", "bytes", "lines", "unmatched", "balance"))
+        for s in self.files:
+            f.write(row.format(
+                os.path.basename(s.file)[-60:], "yes" if s.cached else "", f"{s.pdftotext * 1000:.1f}ms",
+                f"{s.parse * 1000:.1f}ms", s.text_bytes, s.lines, s.not_matched, s.balance or "",
+            ))
+        t = self.totals()
+        f.write(row.format(
+            f"total ({t['files']} files)", t["cached"], f"{t['pdftotext'] * 1000:.1f}ms", f"{t['parse'] * 1000:.1f}ms",
+            t["text_bytes"], t["lines"], t["not_matched"], ", ".join(f"{n} {k}" for k, n in sorted(t["balance"].items(), key=str)),
+        ))
+        f.write(f"writing: {t['write'] * 1000:.1f}ms\n\n")
+        row = "{:<32} {:>9} {:>9} {:>10}\n"
+        f.write(row.format("pattern", "attempts", "hits", "time"))
+        for name, (attempts, hits, seconds) in sorted(self.patterns().items(), key=lambda p: -p[1][2]):
+            f.write(row.format(name, attempts, hits, f"{seconds * 1000:.1f}ms"))
+
+
+# FileStats of the statement that is currently parsed in this process, None unless stats are collected
+file_stats = None
+
+
+@lru_cache(maxsize=None)
+def pattern_name(pattern):
+    """returns the name of a module level pattern"""
+    return next((name for name, value in globals().items() if value is pattern), pattern.pattern)
+
+
+def balance_status(transactions, statement):
+    """returns whether the balance difference of a statement matches its transactions: 'ok', 'mismatch' or 'missing'"""
+    if "balance_new" not in statement or "balance_old" not in statement:
+        return "missing"
+    transactions_sum = sum(t["value"] for t in transactions)
+    return "ok" if transactions_sum == statement["balance_new"] - statement["balance_old"] else "mismatch"
+
+
+def file_digest(pdf):
+    """returns the SHA-256 hex digest of the content of pdf, computed once per size and mtime"""
+    stat = os.stat(pdf)
+    return _file_digest(pdf, stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=4096)
+def _file_digest(pdf, size, mtime):
+    import hashlib
+    with open(pdf, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def walk_statements(root):
+    """returns (reader, path) for every DKB bank or visa statement below root, in os.walk order
+
+    Symbolic links to directories are followed, but every directory is scanned only once, which
+    also breaks link cycles."""
+    found = []
+    visited = set()
+    stack = [root]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            stat = os.stat(dirpath)
+            if (stat.st_dev, stat.st_ino) in visited:
+                continue
+            visited.add((stat.st_dev, stat.st_ino))
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError as e:
+            logging.warning(f"can not scan {dirpath}: {e}")
+            continue
+        logging.info(f"scanning {dirpath} ...")
+        subdirs = []
+        for entry in entries:
+            # cheap test first, both kinds of statements start with a K
+            if entry.name.startswith("K"):
+                match = re_statement_filename.match(entry.name)
+                if match:
+                    reader = read_visa_statement if match.lastgroup == "visa" else read_bank_statement
+                    found.append((reader, f"{dirpath}/{entry.name}"))
+                    continue
+            try:
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+            except OSError:
+                pass
+        stack.extend(reversed(subdirs))
+    return found
+
+
+def find_statements(dirpaths):
+    """Recursively scans dirpaths and yields (reader, path) for every DKB bank or visa statement
+
+    Several directories are scanned concurrently, which helps on network file systems, but the
+    statements are yielded in the order of dirpaths."""
+    if len(dirpaths) < 2:
+        for dirpath in dirpaths:
+            yield from walk_statements(dirpath)
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(len(dirpaths), 8)) as executor:
+        for found in executor.map(walk_statements, dirpaths):
+            yield from found
+
+def read_statement(reader, pdf, table=None, collect_stats=False, backend="pdftotext", keep_table=True):
+    """calls reader(pdf, table) and returns the extracted text, the result and FileStats if collect_stats
+
+    Unless keep_table or collect_stats is set, the text is parsed while it is extracted and None
+    is returned instead of it. Any error is logged instead of raised, the result is None in that
+    case."""
+    global file_stats
+    file_stats = FileStats(pdf) if collect_stats else None
+    stats = file_stats
+    result = None
+    try:
+        start = time.perf_counter()
+        lines = None
+        if table is None:
+            if keep_table or stats:
+                table = read_pdf_table(pdf, backend)
+            else:
+                # nothing needs the whole text, parse it while it is extracted
+                lines = iter_pdf_lines(pdf, backend)
+        if stats:
+            stats.pdftotext = time.perf_counter() - start
+            stats.set_table(table)
+        start = time.perf_counter()
+        result = reader(pdf, table if lines is None else lines)
+        if stats:
+            stats.parse = time.perf_counter() - start
+            stats.balance = balance_status(*result)
+    except Exception:
+        logging.exception(f"failed to parse {pdf}")
+        if stats:
+            stats.balance = "error"
+    finally:
+        file_stats = None
+    return table, result, stats
+
+def init_worker(level, page_jobs=1):
+    """configures logging and extraction in worker processes, which do not inherit them on every platform"""
+    logging.basicConfig(level=level, format='%(levelname)s: %(message)s')
+    PdftotextExtractor.page_jobs = page_jobs
+
+def run_bounded(tasks, jobs=1):
+    """runs tasks and lazily yields (context, result) for each in the order of tasks
+
+    tasks is an iterable of (context, function, args), the result of a task is function(*args).
+    A task with function None has its result in args already and is passed through in order.
+    With jobs > 1 the functions are run by a pool of worker processes, and tasks are only taken
+    from the iterable while at most four per worker are pending, so a slow consumer holds back a
+    fast producer. Pending tasks are cancelled when the consumer stops early."""
+    from concurrent.futures import Future, ProcessPoolExecutor
+    executor = None
+    if jobs > 1:
+        compile_patterns()  # once here rather than in every forked worker
+        level = logging.getLogger().getEffectiveLevel()
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(level, PdftotextExtractor.page_jobs))
+    window = 4 * jobs
+    pending = deque()
+    try:
+        for context, function, args in tasks:
+            if function is not None and executor:
+                future = executor.submit(function, *args)
+            else:
+                future = Future()
+                future.set_result(args if function is None else function(*args))
+            pending.append((context, future))
+            while len(pending) > window or (pending and pending[0][1].done()):
+                context, future = pending.popleft()
+                yield context, future.result()
+        while pending:
+            context, future = pending.popleft()
+            yield context, future.result()
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+def iter_statements(dirpaths, jobs=1, cache=None, manifest=None, stats=None, backend="pdftotext", filters=None, duplicates=None):
+    """Recursively scans dirpaths for DKB bank or visa statements and yields (transactions, statement) for each
+
+    See read_statements for the arguments."""
+    yield from read_statements(find_statements(dirpaths), jobs, cache, manifest, stats, backend, filters, duplicates)
+
+def read_statements(found, jobs=1, cache=None, manifest=None, stats=None, backend="pdftotext", filters=None, duplicates=None):
+    """Reads the statements in found, (reader, path) pairs, and yields (transactions, statement) for each
+
+    With jobs > 1 the statements are read by a pool of worker processes, at most a few per worker
+    ahead of the consumer, see run_bounded. Results are yielded in discovery order, so the output is identical to a
+    serial run. An optional StatementCache is consulted before any statement is extracted or parsed.
+    If a Manifest is given, files that it lists as processed are skipped and successfully parsed
+    files are added to it. If RunStats are given, FileStats of every statement are added to them.
+    backend names the extractor in EXTRACTORS that turns PDFs into text. Files that a
+    StatementFilter in filters rejects by their name are skipped. Unless duplicates is None, files
+    with the same content as one found before are skipped and (duplicate, original) is appended
+    to it."""
+    originals = {}
+
+    def tasks():
+        for reader, pdf in found:
+            # a file that vanished or can not be read is skipped, like one that fails to parse
+            try:
+                if filters and not filters.accepts_file(pdf):
+                    logging.info(f"skipping {pdf}, its name is out of the filter range")
+                    continue
+                if manifest is not None and manifest.is_processed(pdf):
+                    continue
+                if duplicates is not None:
+                    digest = file_digest(pdf)
+                    if digest in originals:
+                        logging.info(f"skipping {pdf}, it is a copy of {originals[digest]}")
+                        duplicates.append((pdf, originals[digest]))
+                        continue
+                    originals[digest] = pdf
+            except OSError as e:
+                logging.error(f"skipping {pdf}: {e}")
+                continue
+            table = result = None
+            if cache:
+                try:
+                    table = cache.get_table(pdf)
+                    if table is not None:
+                        result = cache.get_statement(reader, pdf, table)
+                except OSError as e:
+                    logging.warning(f"cache lookup for {pdf} failed, extracting it: {e}")
+                    table = result = None
+                if result is not None and stats is not None:
+                    file_stats = FileStats(pdf, cached=True)
+                    file_stats.set_table(table)
+                    file_stats.balance = balance_status(*result)
+                    stats.add(file_stats)
+            if result is not None:
+                yield (reader, pdf, table, False), None, result
+            else:
+                yield (reader, pdf, table, True), read_statement, (reader, pdf, table, stats is not None, backend, cache is not None)
+
+    results = run_bounded(tasks(), jobs)
+    try:
+        for (reader, pdf, table, read), result in results:
+            if read:
+                extracted, result, file_stats = result
+                if stats is not None:
+                    stats.add(file_stats)
+                if cache and extracted is not None:
+                    try:
+                        if table is None:
+                            cache.put_table(pdf, extracted)
+                        if result is not None:
+                            cache.put_statement(reader, extracted, result)
+                    except OSError as e:
+                        logging.warning(f"could not cache {pdf}: {e}")
+            if result is not None:
+                if manifest is not None:
+                    manifest.add(pdf)
+                yield result
+    finally:
+        results.close()
+        if cache:
+            cache.trim()
+
+def scan_dirs(dirpaths, jobs=1, cache=None, manifest=None, backend="pdftotext", filters=None, duplicates=None):
+    """Recursively scans dirpath for DKB bank or visa statements and returns all parsed transactions and statements
+
+    See iter_statements for the arguments."""
     transactions = []
     statements = []
-    for dirpath in dirpaths:
-        for dirpath, unused_dirnames, filenames in os.walk(dirpath):
-            logging.info(f"scanning {dirpath} ...")
-            for filename in filenames:
-                if re_visa_filename.match(filename):
-                    transactions_statement, statement = read_visa_statement(
-                        f"{dirpath}/{filename}"
-                    )
-                    statements.append(statement)
-                    transactions.extend(transactions_statement)
-                elif re_filename.match(filename):
-                    transactions_statement, statement = read_bank_statement(
-                        f"{dirpath}/{filename}"
-                    )
-                    statements.append(statement)
-                    transactions.extend(transactions_statement)
+    for transactions_statement, statement in iter_statements(dirpaths, jobs, cache, manifest, backend=backend, filters=filters, duplicates=duplicates):
+        statements.append(statement)
+        if filters:
+            transactions_statement = [t for t in transactions_statement if filters.accepts(t)]
+        transactions.extend(transactions_statement)
 
     return transactions, statements
 
-def read_pdf_table(fname):
-    """Reads contents of a PDF table into a string using pdftotext"""
+class StatementWatcher:
+    """Keeps the transactions of the statements below dirpaths in memory and up to date
+
+    Every poll rescans the directories and compares size and modification time of the statement
+    files with the last poll. Only new or changed files are read, see read_statements for the
+    arguments, and transactions of removed files are dropped. Unless keep_duplicates is set, files
+    with the same content as one found before them are ignored. The transactions are kept sorted
+    by value date and each output format is rendered at most once per change. New statements are
+    checked against the chain of their account in the BalanceIndex balances, if given."""
+
+    def __init__(self, dirpaths, jobs=1, cache=None, backend="pdftotext", filters=None, keep_duplicates=False, balances=None):
+        self.dirpaths = list(dirpaths)
+        self.jobs = jobs
+        self.cache = cache
+        self.backend = backend
+        self.filters = filters
+        self.keep_duplicates = keep_duplicates
+        self.balances = balances
+        self.files = {}  # path -> (size, mtime_ns) at the last poll, in discovery order
+        self.results = {}  # path -> (transactions, statement), None if it could not be parsed
+        self.transactions = []
+        self.statements = []
+        self.rendered = {}  # format -> (ETag, data)
+        self.lock = threading.Lock()
+
+    def poll(self):
+        """reads new and changed statements, returns the number of files that were added, changed or removed"""
+        found = []
+        files = {}
+        for reader, pdf in find_statements(self.dirpaths):
+            try:
+                stat = os.stat(pdf)
+            except OSError:
+                continue  # removed while scanning
+            files[pdf] = (stat.st_size, stat.st_mtime_ns)
+            if self.files.get(pdf) != files[pdf]:
+                found.append((reader, pdf))
+        removed = self.files.keys() - files.keys()
+        if not found and not removed:
+            return 0
+        results = {pdf: None for _, pdf in found}
+        for result in read_statements(found, min(self.jobs, len(found)), self.cache, backend=self.backend, filters=self.filters):
+            results[result[1]["file"]] = result
+        results = {**{pdf: result for pdf, result in self.results.items() if pdf in files}, **results}
+
+        transactions = []
+        statements = []
+        originals = set()
+        for pdf in files:
+            if results.get(pdf) is None:
+                continue
+            if not self.keep_duplicates:
+                digest = file_digest(pdf)
+                if digest in originals:
+                    continue
+                originals.add(digest)
+            transactions_statement, statement = results[pdf]
+            if self.filters:
+                transactions_statement = [t for t in transactions_statement if self.filters.accepts(t)]
+            transactions.extend(transactions_statement)
+            statements.append(statement)
+        transactions.sort(key=valued_key, reverse=True)
+        if self.balances is not None:
+            self.balances.update(statements)
+            for problem in self.balances.check(self.dirpaths):
+                logging.warning(f"balance chain: {problem}")
+            self.balances.save()
+
+        with self.lock:
+            self.files = files
+            self.results = results
+            self.transactions = transactions
+            self.statements = statements
+            self.rendered = {}
+        changed = len(found) + len(removed)
+        logging.info(f"{changed} statement files changed, {len(transactions)} transactions from {len(statements)} statements")
+        return changed
+
+    def render(self, format):
+        """returns (ETag, transactions in one of the text formats in SINKS as bytes)
+
+        The ETag is a hash of the bytes, so an ETag from an earlier process only matches the same data."""
+        with self.lock:
+            rendered = self.rendered.get(format)
+            if rendered is None:
+                import hashlib
+                f = io.StringIO()
+                write_transactions([SINKS[format](f)], self.transactions, sort=False)
+                data = f.getvalue().encode()
+                rendered = self.rendered[format] = (f'"{hashlib.sha256(data).hexdigest()[:32]}"', data)
+            return rendered
+
+    def run(self, interval, stop):
+        """polls every interval seconds until the threading.Event stop is set"""
+        while not stop.wait(interval):
+            try:
+                self.poll()
+            except Exception:
+                logging.exception("failed to poll statements")
+
+
+@lru_cache(maxsize=None)
+def watch_server_classes():
+    """returns the request handler and Unix socket server classes of --watch, which import http.server"""
+    import socketserver
+    from http.server import BaseHTTPRequestHandler
+
+    class WatchRequestHandler(BaseHTTPRequestHandler):
+        """Serves the transactions of the server's StatementWatcher"""
+
+        paths = {
+            "/": ("dkb", "text/csv; charset=utf-8"),
+            "/transactions.csv": ("dkb", "text/csv; charset=utf-8"),
+            "/moneymoney.csv": ("moneymoney", "text/csv; charset=utf-8"),
+            "/transactions.json": ("json", "application/json"),
+        }
+
+        def do_GET(self):
+            if self.path.split("?")[0] not in self.paths:
+                self.send_error(404, explain=f"try one of {', '.join(self.paths)}")
+                return
+            format, content_type = self.paths[self.path.split("?")[0]]
+            etag, data = self.server.watcher.render(format)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # the default uses client_address, which is empty for Unix sockets
+            logging.info(format % args)
+
+    class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+    return WatchRequestHandler, UnixHTTPServer
+
+
+def make_server(address, watcher):
+    """returns a server for watcher listening on address, either host:port or unix:path
+
+    A socket at path is removed, any other file raises a FileExistsError."""
+    from http.server import ThreadingHTTPServer
+    WatchRequestHandler, UnixHTTPServer = watch_server_classes()
+    if address.startswith("unix:"):
+        import stat
+        path = address[len("unix:"):]
+        try:
+            mode = os.lstat(path).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError(f"{path} exists and is not a socket")
+            os.unlink(path)  # left over from an earlier run
+        server = UnixHTTPServer(path, WatchRequestHandler)
+    else:
+        host, _, port = address.rpartition(":")
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), WatchRequestHandler)
+    server.watcher = watcher
+    return server
+
+
+def watch_statements(dirpaths, address, interval, jobs=1, cache=None, backend="pdftotext", filters=None, keep_duplicates=False, balances=None):
+    """parses the statements below dirpaths, serves their transactions on address and polls for new ones until interrupted"""
+    import click
+    watcher = StatementWatcher(dirpaths, jobs, cache, backend, filters, keep_duplicates, balances)
+    # before the first poll, which may take long, so that a wrong --listen fails at once
+    try:
+        server = make_server(address, watcher)
+    except FileExistsError as e:
+        raise click.UsageError(f"--listen {address}: {e}")
+    watcher.poll()
+    click.echo(f"Parsed {len(watcher.transactions)} transactions from {len(watcher.statements)} statements", err=True)
+    stop = threading.Event()
+    poller = threading.Thread(target=watcher.run, args=(interval, stop), daemon=True)
+    poller.start()
+    click.echo(f"Serving on {address}, polling every {interval} seconds", err=True)
+    # shutdown() waits for serve_forever() to return, so it can not be called from the handler
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        if address.startswith("unix:"):
+            os.unlink(address[len("unix:"):])
+
+@lru_cache(maxsize=None)
+def pdftotext_version():
+    """returns the version line printed by pdftotext -v"""
     completed_process = subprocess.run(
-        ["pdftotext", "-layout", fname, "-"],
+        ["pdftotext", "-v"],
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
     )
-    err_lines = completed_process.stderr.decode().split("\n")
-    for err_line in err_lines:
-        logging.debug(f"pdftotext.stderr: {err_line}")
-    return completed_process.stdout.decode()
+    return completed_process.stdout.decode().strip().split("\n")[0]
+
+
+class PdftotextExtractor:
+    """Runs pdftotext -layout in a subprocess for every file
+
+    iter_lines() parses the output while pdftotext is still writing it. With page_jobs > 1,
+    documents with more pages than that are split into page ranges that are extracted by
+    concurrent pdftotext processes and stitched together in page order."""
+
+    # set per process, see init_worker
+    page_jobs = 1
+
+    def version(self):
+        return pdftotext_version()
+
+    def extract_bytes(self, data):
+        """returns the text of the PDF content data, which pdftotext reads from stdin"""
+        return self.run(["pdftotext", "-layout", "-", "-"], data)
+
+    def extract(self, fname):
+        if self.page_jobs > 1:
+            pages = pdf_page_count(fname)
+            if pages > self.page_jobs:
+                table = self.extract_pages(fname, pages)
+                if table is not None:
+                    return table
+        return self.run(["pdftotext", "-layout", fname, "-"])
+
+    def run(self, args, data=None):
+        completed_process = subprocess.run(
+            args,
+            input=data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        err_lines = completed_process.stderr.decode().split("\n")
+        for err_line in err_lines:
+            logging.debug("pdftotext.stderr: %s", err_line)
+        return completed_process.stdout.decode()
+
+    def extract_pages(self, fname, pages):
+        """returns the text of fname extracted in page ranges by page_jobs processes, None if it does not stitch"""
+        from concurrent.futures import ThreadPoolExecutor
+        size = -(-pages // self.page_jobs)
+        ranges = [(first, min(first + size - 1, pages)) for first in range(1, pages + 1, size)]
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            parts = list(executor.map(
+                lambda r: self.run(["pdftotext", "-layout", "-f", str(r[0]), "-l", str(r[1]), fname, "-"]),
+                ranges,
+            ))
+        # pdftotext ends every page with a form feed, a range that is short of pages failed
+        for (first, last), part in zip(ranges, parts):
+            if part.count("\f") != last - first + 1:
+                logging.warning(f"pages {first}-{last} of {fname} did not extract, extracting it as a whole")
+                return None
+        table = "".join(parts)
+        if not carry_lines_match(table.splitlines()):
+            logging.warning(f"page subtotals of {fname} do not carry over, extracting it as a whole")
+            return None
+        return table
+
+    def iter_lines(self, fname):
+        """yields the lines of the text of fname as pdftotext writes them"""
+        if self.page_jobs > 1:
+            yield from self.extract(fname).splitlines()
+            return
+        args = ["pdftotext", "-layout", fname, "-"]
+        if not logging.root.isEnabledFor(logging.DEBUG):
+            # stderr is only logged for debugging
+            yield from self.stream(args, subprocess.DEVNULL)
+            return
+        import tempfile
+        with tempfile.TemporaryFile() as stderr:
+            # stderr goes to a file, a full pipe would block pdftotext
+            yield from self.stream(args, stderr)
+            stderr.seek(0)
+            for err_line in stderr.read().decode().split("\n"):
+                logging.debug("pdftotext.stderr: %s", err_line)
+
+    def stream(self, args, stderr):
+        """runs args and yields the lines of its output while it is running"""
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            # UTF-8 continuation bytes are never newlines, and splitlines() also splits at
+            # the form feeds that end pages, like str.splitlines() on the whole text
+            for line in process.stdout:
+                yield from line.decode().splitlines()
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()  # the reader stopped early
+            process.wait()
+
+
+@lru_cache(maxsize=64)
+def pdf_page_count(fname):
+    """returns the number of pages of fname according to pdfinfo, 0 if that is not available"""
+    try:
+        completed_process = subprocess.run(["pdfinfo", fname], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return 0
+    for line in completed_process.stdout.decode(errors="replace").splitlines():
+        if line.startswith("Pages:"):
+            return int(line.split()[1])
+    return 0
+
+
+def carry_lines_match(lines):
+    """checks that every "Übertrag von Seite n" carries the "Zwischensumme Seite n" found before it"""
+    subtotals = {}
+    for line in lines:
+        stripped = line.lstrip()
+        if stripped.startswith(("Zwischensumme", "Übertrag von")):
+            match = re_visa_subtotal.match(line)
+            if match is None:
+                continue
+            value = (match["value"], match["sign"])
+            if match["kind"] == "Zwischensumme":
+                subtotals[match["page"]] = value
+            elif subtotals.get(match["page"], value) != value:
+                return False
+    return True
+
+
+class PypdfExtractor:
+    """Extracts text in-process with the layout mode of pypdf, which mimics pdftotext -layout
+
+    pypdf is an optional dependency, it is imported once per process together with its font
+    and encoding tables and then reused for every file."""
+
+    def __init__(self):
+        import pypdf
+        self.pypdf = pypdf
+
+    def version(self):
+        return f"pypdf {self.pypdf.__version__}"
+
+    def extract(self, fname):
+        return "".join(self.iter_pages(fname))
+
+    def extract_bytes(self, data):
+        """returns the text of the PDF content data"""
+        return "".join(self.iter_pages(io.BytesIO(data)))
+
+    def iter_pages(self, fname):
+        reader = self.pypdf.PdfReader(fname)
+        # pdftotext ends every page with a form feed
+        for page in reader.pages:
+            yield page.extract_text(extraction_mode="layout", layout_mode_space_vertically=False) + "\n\f"
+
+    def iter_lines(self, fname):
+        """yields the lines of the text of fname page by page"""
+        for page in self.iter_pages(fname):
+            yield from page.splitlines()
+
+
+# text extraction backends by name, see --backend
+EXTRACTORS = {"pdftotext": PdftotextExtractor, "pypdf": PypdfExtractor}
+
+
+@lru_cache(maxsize=None)
+def get_extractor(backend):
+    """returns the extractor instance of this process for backend"""
+    return EXTRACTORS[backend]()
+
+
+def read_pdf_table(fname, backend="pdftotext"):
+    """Reads contents of a PDF table into a string using the extractor backend, pdftotext by default"""
+    return get_extractor(backend).extract(fname)
+
+
+def iter_pdf_lines(fname, backend="pdftotext"):
+    """Yields the lines of a PDF table as the extractor backend produces them, pdftotext by default"""
+    return get_extractor(backend).iter_lines(fname)
 
 
 def check_match(re, line, result):
     """calls re.match(line) but also writes the return value to result['match'] and writes match to log"""
+    if file_stats is not None:
+        return file_stats.check_match(re, line, result)
     match = re.match(line)
     if match:
         result["match"] = match
-        logging.debug(f"'{line}'\t{match.groupdict()}\t{re.pattern}")
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("'%s'\t%s\t%s", line, match.groupdict(), re.pattern)
     return match
 
 
+def not_matched(line):
+    """records a line that no pattern matched"""
+    if file_stats is not None:
+        file_stats.not_matched += 1
+    logging.debug("'%s'\tNOT MATCHED", line)
+
+
+# Conversion kernels: a statement has about 30 distinct dates and far fewer distinct amounts than
+# transactions, so results are memoized. Fast paths slice fixed-width strings instead of going
+# through strptime, anything else falls back to the exact original conversion.
+
+@lru_cache(maxsize=4096)
 def decimal(s):
     return Decimal(s.replace(".", "").replace(",", "."))
 
 
 def date(s, format="%d.%m.%Y"):
+    if format == "%d.%m.%Y":
+        return german_to_date(s)
     return datetime.strptime(s, format).date()
 
 
+@lru_cache(maxsize=1024)
+def german_to_date(s):
+    """parses DD.MM.YYYY"""
+    if len(s) == 10 and s[2] == s[5] == "." and s.isascii() and (s[:2] + s[3:5] + s[6:]).isdigit():
+        return calendar_date(int(s[6:]), int(s[3:5]), int(s[:2]))
+    return datetime.strptime(s, "%d.%m.%Y").date()
+
+
+@lru_cache(maxsize=1024)
+def day_month_to_date(s, year):
+    """parses DD.MM. of the given year"""
+    return german_to_date(f"{s}{year}")
+
+
+@lru_cache(maxsize=1024)
+def visa_to_date(s):
+    """parses DD.MM.YY (of this century) or DD.MM.YYYY as found on VISA statements"""
+    if len(s) == 8:
+        return german_to_date(f"{s[:6]}20{s[6:]}")
+    return german_to_date(s)
+
+
+@lru_cache(maxsize=1024)
+def iso_date(s):
+    """parses YYYY-MM-DD"""
+    if len(s) == 10 and s[4] == s[7] == "-" and s.isascii() and (s[:4] + s[5:7] + s[8:]).isdigit():
+        return calendar_date(int(s[:4]), int(s[5:7]), int(s[8:]))
+    return datetime.strptime(s, "%Y-%m-%d").date()
+
+
+@lru_cache(maxsize=4096)
+def cents_decimal(s):
+    """parses an amount as written to the CSV, quantized to cents"""
+    return Decimal(s).quantize(Decimal("0.01"))
+
+
+@lru_cache(maxsize=1024)
+def german_date(d):
+    """formats a date as DD.MM.YYYY"""
+    return d.strftime("%d.%m.%Y")
+
+
+def german_amount(value):
+    """formats an amount with two decimals and a decimal comma"""
+    # memoized on the string, equal Decimals like 0.00 and -0.00 are formatted differently
+    return _german_amount(str(value))
+
+
+@lru_cache(maxsize=4096)
+def _german_amount(s):
+    return f"{Decimal(s):.2f}".replace(".", ",")
+
+
 def sign(s):
     return -1 if s in ["-", "S"] else 1
 
 
+def starts_with_date(s):
+    """cheap test whether s starts like DD.MM., lines failing it can not match any DATE pattern"""
+    return s[2:3] == "." and s[5:6] == "." and s[:2].isdigit()
+
+
+def is_new_bank_format(lines):
+    """detects the bank statement format from the lines up to the first transaction table header
+
+    The new format states "Kontoauszug <no>/<year>" above its table, the old format never does."""
+    for line in lines:
+        if "Kontoauszug" in line and re_statement_new.search(line):
+            return True
+        if re_table_header.match(line) or re_table_header_new.match(line):
+            return False
+    return False
+
+
 def parse_new_filename(filename):
     """Parse statement info from new DKB filename format"""
     # Extract from: Kontoauszug_8_2024_vom_05.08.2024_zu_Konto_1010001491.pdf
@@ -283,43 +1960,101 @@ def parse_new_filename(filename):
     return None
 
 
-def read_bank_statement(pdf):
-    """returns transactions list and statement summary extracted from a DKB bank statement"""
+def filename_metadata(filename):
+    """returns account and statement date encoded in a statement file name, None if it has none"""
+    basename = os.path.basename(filename)
+    for pattern in re_filename_metadata:
+        match = pattern.match(basename)
+        if match:
+            return {
+                "account": match.group("account").replace("_", "X").replace("x", "X"),
+                "date": datetime(int(match.group("year")), int(match.group("month")), int(match.group("day"))).date(),
+            }
+    return None
+
+
+def table_lines(pdf, table):
+    """returns the lines of table, the text of pdf, which may be given as lines already or be None to stream them"""
+    if table is None:
+        return iter_pdf_lines(pdf)
+    if isinstance(table, str):
+        return table.splitlines()
+    return table
+
+
+def read_bank_statement(pdf, table=None):
+    """returns transactions list and statement summary extracted from a DKB bank statement
+
+    table is the pdftotext output of pdf or an iterable of its lines, it is streamed from
+    pdftotext if not given"""
 
     statement = {"file": pdf}
-    transactions = []
-    res = {}
 
     # Try to extract basic info from filename for new format
     filename_info = parse_new_filename(pdf)
     if filename_info:
         statement.update(filename_info)
 
-    table = read_pdf_table(pdf)
-    lines = table.splitlines()
+    lines = table_lines(pdf, table)
+
+    transactions, statement = read_bank_statement_lines(lines, statement)
+
+    # check for parsing errors
+    if "balance_new" in statement and "balance_old" in statement:
+        transactions_sum = sum(map(lambda t: t["value"], transactions))
+        balance_difference = statement["balance_new"] - statement["balance_old"]
+        if transactions_sum != balance_difference:
+            logging.error(
+                f"parsed balance difference of {balance_difference} and transaction sum of {transactions_sum} for {pdf}!"
+            )
+    else:
+        logging.warning(f"Missing balance information for {pdf}. Found keys: {list(statement.keys())}")
+
+    return transactions, statement
+
+
+def read_bank_statement_lines(lines, statement=None):
+    """returns transactions list and statement summary extracted from DKB bank statement text lines
 
-    # Detect format by checking for new format indicators
-    is_new_format = any(re_statement_new.search(line) for line in lines)
+    statement may be pre-filled, the new format takes the account number from the file name"""
+    statement = {} if statement is None else statement
+    transactions = []
+    res = {}
+
+    # the format is detected from the first lines, tee keeps them for the loop below
+    lines, head = tee(lines)
+    is_new_format = is_new_bank_format(head)
+    del head
+    if is_new_format and "account" not in statement:
+        raise ValueError(
+            f"{statement.get('file', '-')} is a new format bank statement, which states its account number only in "
+            "its original file name, pass that as name (parse-file --name), e.g. Kontoauszug_8_2024_vom_05.08.2024_zu_Konto_1010001491.pdf"
+        )
 
     match_table_header = None
     transaction_number = 1
 
+    # Every pattern is guarded by a cheap test on the line prefix or indentation that is necessary
+    # for it to match, so most lines are tried against one regex at most.
     for line in lines:
+        stripped = line.lstrip()
+        indent = len(line) - len(stripped)
+        dated = starts_with_date(stripped)
         if is_new_format:
             # New format patterns
-            if check_match(re_statement_new, line, res):
+            if line.startswith("Kontoauszug ") and check_match(re_statement_new, line, res):
                 match = res["match"]
                 statement["no"] = int(match.group("no"))
                 statement["year"] = int(match.group("year"))
-            elif check_match(re_balance_old_new, line, res):
+            elif line.startswith("Kontostand am ") and check_match(re_balance_old_new, line, res):
                 match = res["match"]
                 statement["balance_old"] = decimal(match.group("old"))
-            elif check_match(re_balance_new_new, line, res):
+            elif line.startswith("Kontostand am ") and check_match(re_balance_new_new, line, res):
                 match = res["match"]
                 statement["balance_new"] = decimal(match.group("new"))
-            elif check_match(re_table_header_new, line, res):
+            elif line.startswith("Datum") and check_match(re_table_header_new, line, res):
                 match_table_header = res["match"]
-            elif check_match(re_transaction_new_soll, line, res):
+            elif dated and check_match(re_transaction_new_soll, line, res):
                 match = res["match"]
                 # Transaction in Soll (debit) column - use as-is (already has sign)
                 if match.group("soll"):
@@ -327,22 +2062,21 @@ def read_bank_statement(pdf):
                 else:
                     value = 0
 
+                booked = date(match.group("booked"))
                 transactions.append(
-                    {
-                        "account": f'{statement["account"]:0>16}',
-                        "year": statement['year'],
-                        "statement": f"{statement['no']:02}",
-                        "transaction": f"{transaction_number:03}",
-                        "booked": date(match.group("booked")),
-                        "valued": date(match.group("booked")),  # New format uses same date
-                        "type": match.group("type").strip(),
-                        "value": value,
-                        "payee": "",
-                        "comment": "",
-                    }
+                    Transaction(
+                        sys.intern(statement["account"]),
+                        statement['year'],
+                        statement['no'],
+                        transaction_number,
+                        booked,
+                        booked,  # New format uses same date
+                        (match.group("type") or "").strip(),
+                        value,
+                    )
                 )
                 transaction_number += 1
-            elif check_match(re_transaction_new_haben, line, res):
+            elif dated and check_match(re_transaction_new_haben, line, res):
                 match = res["match"]
                 # Transaction in Haben (credit) column - use as-is (already positive)
                 if match.group("haben"):
@@ -350,94 +2084,80 @@ def read_bank_statement(pdf):
                 else:
                     value = 0
 
+                booked = date(match.group("booked"))
                 transactions.append(
-                    {
-                        "account": f'{statement["account"]:0>16}',
-                        "year": statement['year'],
-                        "statement": f"{statement['no']:02}",
-                        "transaction": f"{transaction_number:03}",
-                        "booked": date(match.group("booked")),
-                        "valued": date(match.group("booked")),  # New format uses same date
-                        "type": match.group("type").strip(),
-                        "value": value,
-                        "payee": "",
-                        "comment": "",
-                    }
+                    Transaction(
+                        sys.intern(statement["account"]),
+                        statement['year'],
+                        statement['no'],
+                        transaction_number,
+                        booked,
+                        booked,  # New format uses same date
+                        (match.group("type") or "").strip(),
+                        value,
+                    )
                 )
                 transaction_number += 1
-            elif transactions and line.startswith('              ') and line.strip() and not re_statement_new.match(line):
+            elif transactions and line.startswith('              ') and stripped:
                 # Transaction details for new format - lines starting with exactly 14 spaces
-                if not transactions[-1]["payee"]:
-                    transactions[-1]["payee"] = line.strip()
-                    transactions[-1]["comment"] = line.strip()
+                if not transactions[-1].payee:
+                    transactions[-1].payee = stripped.rstrip()
+                    transactions[-1].comment = transactions[-1].payee
                 else:
-                    transactions[-1]["comment"] += " " + line.strip()
+                    transactions[-1].comment += " " + stripped.rstrip()
         else:
             # Old format patterns
-            if check_match(re_range, line, res):
+            if line.startswith("Kontoauszug Nummer") and check_match(re_range, line, res):
                 match = res["match"]
                 statement["no"] = int(match.group("no"))
                 statement["year"] = int(match.group("year"))
                 statement["from"] = date(match.group("from"))
                 statement["to"] = date(match.group("to"))
-            elif check_match(re_account, line, res):
+            elif line.startswith("Kontonummer") and check_match(re_account, line, res):
                 match = res["match"]
                 statement["account"] = match.group("account")
                 statement["iban"] = match.group("iban")
-            elif check_match(re_balance_old, line, res):
+            elif line.startswith("ALTER KONTOSTAND") and check_match(re_balance_old, line, res):
                 match = res["match"]
                 statement["balance_old"] = decimal(match.group("old")) * sign(
                     match.group("sign")
                 )
-            elif check_match(re_balance_new, line, res):
+            elif line.startswith("NEUER KONTOSTAND") and check_match(re_balance_new, line, res):
                 match = res["match"]
                 statement["balance_new"] = decimal(match.group("new")) * sign(
                     match.group("sign")
                 )
-            elif check_match(re_table_header, line, res):
+            elif line.startswith("Bu") and check_match(re_table_header, line, res):
                 match_table_header = res["match"]
-            elif check_match(re_transaction, line, res):
+            elif dated and check_match(re_transaction, line, res):
                 match = res["match"]
                 value = decimal(match.group("value"))
                 if match.start("value") < match_table_header.end("minus"):
                     value = -value
                 transactions.append(
-                    {
-                        "account": f'{statement["account"]:0>16}',
-                        "year": statement['year'],
-                        "statement": f"{statement['no']:02}",
-                        "transaction": f"{transaction_number:03}",
-                        "booked": date(match.group("booked") + str(statement["year"])),
-                        "valued": date(match.group("valued") + str(statement["year"])),
-                        "type": match.group("type").strip(),
-                        "value": value,
-                        "payee": "",
-                        "comment": "",
-                    }
+                    Transaction(
+                        sys.intern(statement["account"]),
+                        statement['year'],
+                        statement['no'],
+                        transaction_number,
+                        day_month_to_date(match.group("booked"), statement["year"]),
+                        day_month_to_date(match.group("valued"), statement["year"]),
+                        match.group("type").strip(),
+                        value,
+                    )
                 )
                 transaction_number += 1
-            elif check_match(re_transaction_details, line, res) and match_table_header:
+            elif (indent >= 3 or dated) and check_match(re_transaction_details, line, res) and match_table_header:
                 match = res["match"]
                 if match.start("line") == match_table_header.start("comment"):
-                    if not transactions[-1]["payee"]:
-                        transactions[-1]["payee"] = match.group("line")
-                        transactions[-1]["comment"] = transactions[-1]["payee"]
+                    if not transactions[-1].payee:
+                        transactions[-1].payee = match.group("line")
+                        transactions[-1].comment = transactions[-1].payee
 
                     else:
-                        transactions[-1]["comment"] += " " + match.group("line") # note: line might be missing spaces anywhere
+                        transactions[-1].comment += " " + match.group("line") # note: line might be missing spaces anywhere
             else:
-                logging.debug(f"'{line}'\tNOT MATCHED")
-
-    # check for parsing errors
-    if "balance_new" in statement and "balance_old" in statement:
-        transactions_sum = sum(map(lambda t: t["value"], transactions))
-        balance_difference = statement["balance_new"] - statement["balance_old"]
-        if transactions_sum != balance_difference:
-            logging.error(
-                f"parsed balance difference of {balance_difference} and transaction sum of {transactions_sum} for {pdf}!"
-            )
-    else:
-        logging.warning(f"Missing balance information for {pdf}. Found keys: {list(statement.keys())}")
+                not_matched(line)
 
     return transactions, statement
 
@@ -448,71 +2168,80 @@ def read_visa_statement_lines(lines):
     transactions = []
     statement["balance_old"] = 0
     transaction_number = 1
+    card_no = account = None
     res = {}
 
+    # see read_bank_statement for the guards in front of the patterns
     for line in lines:
-        if check_match(re_visa_balance_old, line, res):
+        stripped = line.lstrip()
+        indent = len(line) - len(stripped)
+        dated = starts_with_date(stripped)
+        if dated and "Saldo letzte" in line and check_match(re_visa_balance_old, line, res):
             match = res["match"]
             value = decimal(match.group("value")) * sign(match.group("sign"))
             statement["balance_old"] = value
-        elif check_match(re_visa_month_year, line, res):
+        elif indent and stripped.startswith("Abrechnung:") and check_match(re_visa_month_year, line, res):
             match = res["match"]
             statement["month"] = match.group("month")
             statement["no"] = MONTHS[statement["month"]]
-            statement["year"] = match.group("year")
-        elif check_match(re_visa_range, line, res):
+            statement["year"] = int(match.group("year"))
+        elif line.startswith("Ihre Abrechnung") and check_match(re_visa_range, line, res):
             match = res["match"]
             statement["from"] = date(match.group("from"))
             statement["to"] = date(match.group("to"))
-        elif check_match(re_visa_balance_new, line, res):
+        elif stripped.startswith("Neuer Saldo") and check_match(re_visa_balance_new, line, res):
             match = res["match"]
             value = decimal(match.group("value")) * sign(match.group("sign"))
             statement["balance_new"] = value
-        elif check_match(re_visa_subtotal, line, res):
+        elif stripped.startswith(("Zwischensumme", "Übertrag von")) and check_match(re_visa_subtotal, line, res):
             pass
-        elif check_match(re_visa_transaction_foreign, line, res) or check_match(
-            re_visa_transaction, line, res
+        elif line.endswith(("+", "-", "S", "H")) and (indent or dated) and (
+            (dated and check_match(re_visa_transaction_foreign, line, res) and res["match"]["currency"] in CURRENCIES)
+            or check_match(re_visa_transaction, line, res)
         ):
             match = res["match"]
             value = decimal(match.group("value")) * sign(match.group("sign"))
             if match.group("booked"):
-                booked = match.group("booked")
-                booked = date(booked[:6] + "20" + booked[6:])
+                booked = visa_to_date(match.group("booked"))
             if match.group("valued"):
-                valued = match.group("valued")
-                valued = date(valued[:6] + "20" + valued[6:])
+                valued = visa_to_date(match.group("valued"))
+            if statement['account'] != card_no:
+                card_no = statement['account']
+                account = sys.intern(''.join(card_no.split()))
             transactions.append(
-                {
-                    "account": ''.join(statement['account'].split()),
-                    "year": statement["year"],
-                    "statement": f"{statement['no']:02}",
-                    "transaction": f"{transaction_number:03}",
-                    "booked": booked,
-                    "valued": valued,
-                    "type": "VISA",
-                    "value": value,
-                    "payee": "",
-                    "comment": match.group("comment"),
-                }
+                Transaction(
+                    account,
+                    statement["year"],
+                    statement['no'],
+                    transaction_number,
+                    booked,
+                    valued,
+                    "VISA",
+                    value,
+                    "",
+                    match.group("comment"),
+                )
             )
             transaction_number += 1
-        elif check_match(re_visa_comment_extended, line, res):
+        elif indent == 18 and check_match(re_visa_comment_extended, line, res):
             match = res["match"]
-            transactions[-1]["comment"] += " " + match["comment_extended"]
+            transactions[-1].comment += " " + match["comment_extended"]
         else:
-            logging.debug(f"'{line}'\tNOT MATCHED")
-        if check_match(re_visa_account, line, res):
+            not_matched(line)
+        if ("VISA-Card:" in line or "Card-Nummer:" in line) and check_match(re_visa_account, line, res):
             match = res["match"]
             statement["account"] = match["account"]
 
     return transactions, statement
 
 
-def read_visa_statement(pdf):
-    """returns transactions list and statement summary extracted from a DKB VISA card statement PDF file"""
+def read_visa_statement(pdf, table=None):
+    """returns transactions list and statement summary extracted from a DKB VISA card statement PDF file
+
+    table is the pdftotext output of pdf or an iterable of its lines, it is streamed from
+    pdftotext if not given"""
     logging.info(f"reading VISA statement {pdf} ...")
-    table = read_pdf_table(pdf)
-    lines = table.splitlines()
+    lines = table_lines(pdf, table)
 
     transactions, statement = read_visa_statement_lines(lines)
     statement['file'] = pdf
@@ -527,12 +2256,173 @@ def read_visa_statement(pdf):
 
     return transactions, statement
 
-@click.command()
-@click.argument('directories', nargs=-1, required=True, type=click.Path(exists=True, file_okay=False, dir_okay=True))
-@click.option('--output', '-o', type=click.File('w'), default=sys.stdout, help='Output CSV file (default: stdout)')
-@click.option('--format', '-f', type=click.Choice(['dkb', 'moneymoney']), default='dkb', help='Output format: dkb (default) or moneymoney')
-@click.option('--verbose', '-v', is_flag=True, help='Enable verbose logging')
-def main(directories, output, format, verbose):
+
+# statement readers by kind, see parse_bytes and parse_many
+READERS = {"bank": read_bank_statement, "visa": read_visa_statement}
+
+
+def statement_kind(lines):
+    """returns "bank" or "visa" for the text lines of a statement, None if they look like neither
+
+    Only the lines above the first transaction are read."""
+    for line in lines:
+        stripped = line.lstrip()
+        if ("VISA-Card:" in line or "Card-Nummer:" in line) and re_visa_account.match(line):
+            return "visa"
+        if stripped.startswith("Ihre Abrechnung") and re_visa_range.match(stripped):
+            return "visa"
+        if "Kontoauszug" in line and (re_range.search(line) or re_statement_new.search(line)):
+            return "bank"
+        if line.startswith("Kontonummer") and re_account.match(line):
+            return "bank"
+        if starts_with_date(stripped):
+            break
+    return None
+
+
+def parse_lines(lines, kind="auto", name="-"):
+    """returns transactions list and statement summary parsed from the text lines of a statement
+
+    kind is "bank", "visa" or "auto" to detect it from the lines. name stands in for the file
+    name, new format bank statements state their account number only there."""
+    if kind == "auto":
+        # the kind is detected from the first lines, tee keeps them for the reader
+        lines, head = tee(lines)
+        kind = statement_kind(head)
+        del head
+        if kind is None:
+            raise ValueError(f"{name} is neither a DKB bank nor a VISA statement")
+    return READERS[kind](name, lines)
+
+
+def parse_bytes(data, kind="auto", name="-", backend="pdftotext"):
+    """returns transactions list and statement summary parsed from the PDF content data
+
+    The PDF is handed to the extractor backend in memory, pdftotext reads it from stdin. See
+    parse_lines for kind and name. Errors are raised."""
+    return parse_lines(get_extractor(backend).extract_bytes(data).splitlines(), kind, name)
+
+
+def parse_source(source, kind="auto", backend="pdftotext"):
+    """parses a path, PDF content as bytes or a (name, bytes) pair, errors are logged and None returned"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        name, data = "-", source
+    elif isinstance(source, tuple):
+        name, data = source
+    else:
+        name, data = os.fspath(source), None
+    try:
+        if data is None:
+            return parse_lines(iter_pdf_lines(name, backend), kind, name)
+        return parse_bytes(bytes(data), kind, name, backend)
+    except ValueError as e:
+        logging.error(f"failed to parse {name}: {e}")
+        return None
+    except Exception:
+        logging.exception(f"failed to parse {name}")
+        return None
+
+
+def parse_many(sources, jobs=1, kind="auto", backend="pdftotext"):
+    """lazily parses sources and yields (transactions, statement) for each in the order of sources
+
+    Sources are paths, PDF content as bytes or (name, bytes) pairs, see parse_bytes. Unless kind
+    is given, it is detected from the text of every source. With jobs > 1 the sources are parsed
+    by a pool of worker processes that takes sources only a few ahead of the consumer, see
+    run_bounded. Sources that can not be parsed are logged and skipped, statement["file"] tells
+    the others apart."""
+    tasks = ((None, parse_source, (source, kind, backend)) for source in sources)
+    results = run_bounded(tasks, jobs)
+    try:
+        for _, result in results:
+            if result is not None:
+                yield result
+    finally:
+        results.close()
+
+
+def parse_file(args=None):
+    """runs the parse-file command on the command line arguments args and returns the exit status
+
+    It parses single statement files for hooks that run once per statement, where starting up
+    costs more than parsing. There are no worker processes and no cache, and neither click nor
+    the modules of the other options are imported. Only the patterns of the statement kind found
+    are compiled. The exit status is 1 if a file could not be parsed."""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="dkbparse.py parse-file",
+        description="Parse DKB bank or VISA statement PDFs and write their transactions, newest first.",
+    )
+    parser.add_argument("files", nargs="+", metavar="FILE", help="statement PDF, - reads it from stdin")
+    parser.add_argument("--name", "-n", default="-", help="original file name of the statement read from stdin, new format bank statements need it for the account number")
+    parser.add_argument("--output", "-o", default="-", help="output file (default: stdout)")
+    parser.add_argument("--format", "-f", choices=sorted(set(SINKS) - {"sqlite"}), default="dkb", help="output format (default: dkb)")
+    parser.add_argument("--kind", "-k", choices=["auto", *READERS], default="auto", help="statement kind (default: detected from the text)")
+    parser.add_argument("--backend", "-b", choices=sorted(EXTRACTORS), default="pdftotext", help="PDF text extraction (default: pdftotext)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="enable verbose logging")
+    args = parser.parse_args(args)
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    transactions = []
+    statements = 0
+    for name in args.files:
+        result = parse_source((args.name, sys.stdin.buffer.read()) if name == "-" else name, args.kind, args.backend)
+        if result is not None:
+            transactions.extend(result[0])
+            statements += 1
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        write_transactions([SINKS[args.format](output)], transactions)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Parsed {len(transactions)} transactions from {statements} statements", file=sys.stderr)
+    return 0 if statements == len(args.files) else 1
+
+
+def merge(args=None):
+    """runs the merge command on the command line arguments args and returns the exit status
+
+    It writes the union of DKB CSV, JSON and MoneyMoney CSV exports, e.g. of different years or
+    parsed by different versions, without duplicates, see MergedExports. Conflicts are logged. The
+    exit status is 1 if there were any."""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="dkbparse.py merge",
+        description="Merge transaction exports without duplicates and write them, newest first.",
+    )
+    parser.add_argument("exports", nargs="+", metavar="EXPORT", help="DKB CSV, JSON or MoneyMoney CSV export, detected from its first line, - reads stdin")
+    parser.add_argument("--output", "-o", default="-", help="output file (default: stdout)")
+    parser.add_argument("--format", "-f", choices=sorted(set(SINKS) - {"sqlite"}), default="dkb", help="output format (default: dkb)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="enable verbose logging")
+    args = parser.parse_args(args)
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    merged = MergedExports()
+    rows = 0
+    for name in args.exports:
+        transactions = read_export(name)
+        rows += len(transactions)
+        for conflict in merged.add(transactions, name):
+            logging.warning(f"conflict: {conflict}")
+        logging.info(f"{name}: {len(transactions)} transactions, {len(merged.transactions)} merged so far")
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        write_transactions([SINKS[args.format](output)], merged.transactions.values())
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Merged {rows} transactions from {len(args.exports)} exports into {len(merged.transactions)}, {merged.duplicates} duplicates, {len(merged.conflicts)} conflicts", file=sys.stderr)
+    return 1 if merged.conflicts else 0
+
+
+def _main(directories, outputs, formats, output_dir, jobs, cache_dir, cache_size, no_cache, incremental, sort, sort_buffer, stats_table, stats_json, backend, page_jobs, since, until, accounts, keep_duplicates, watch, listen, interval, verbose):
     """
     Parse DKB bank and VISA statement PDFs.
 
@@ -553,22 +2443,243 @@ def main(directories, output, format, verbose):
         # Export in MoneyMoney format
         uv run dkbparse.py ~/dkb/ --format moneymoney --output moneymoney.csv
 
+        # Write both formats from a single pass over the statements
+        uv run dkbparse.py ~/dkb/ -f dkb -o transactions.csv -f moneymoney -o moneymoney.csv
+
+        # One file per account and year, e.g. export/bank/0000001010001491/2024.csv, and an index
+        uv run dkbparse.py ~/dkb/ --output-dir export/
+
+        # Parse statements serially instead of on all cores
+        uv run dkbparse.py ~/dkb/ --jobs 1
+
+        # Only add statements that arrived since the last run to transactions.csv
+        uv run dkbparse.py ~/dkb/ --incremental --output transactions.csv
+
+        # Only the second quarter of 2024 for one account, other statements are not even opened
+        uv run dkbparse.py ~/dkb/ --since 2024-04-01 --until 2024-06-30 --account 1010001491
+
+        # Load statements and transactions into an indexed SQLite database
+        uv run dkbparse.py ~/dkb/ --format sqlite --output dkb.sqlite
+
+        # Stream transactions in parsing order instead of sorting them
+        uv run dkbparse.py ~/dkb/ --no-sort
+
+        # Show where the time goes and which statements fail their balance check
+        uv run dkbparse.py ~/dkb/ --stats --output transactions.csv
+
+        # Extract text in-process instead of spawning pdftotext for every file
+        uv run --with pypdf dkbparse.py ~/dkb/ --backend pypdf
+
+        # Keep the transactions in memory and serve them, e.g. curl localhost:8765/transactions.json
+        uv run dkbparse.py ~/dkb/ --watch --listen 127.0.0.1:8765
+
+        # Extract long statements in four page ranges at once, e.g. when re-parsing one year
+        uv run dkbparse.py ~/dkb/2024/ --jobs 1 --page-jobs 4
+
+        # Re-extract and re-parse every statement
+        uv run dkbparse.py ~/dkb/ --no-cache
+
         # Enable verbose logging
         uv run dkbparse.py ~/dkb/ --verbose
+
+        # Parse a single statement with a fast start, without click (see parse-file --help)
+        python3 -m dkbparse parse-file statement.pdf
+
+        # Merge exports of several years and tools without duplicates (see merge --help)
+        python3 -m dkbparse merge 2019.csv 2020.csv moneymoney.csv --output all.csv
     """
+    import click
     if verbose:
         logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
     else:
         logging.basicConfig(level=logging.WARNING)
 
-    transactions, statements = scan_dirs(list(directories))
-
-    click.echo(f"Parsed {len(transactions)} transactions from {len(statements)} statements", err=True)
-
-    if format == 'moneymoney':
-        transactions_to_moneymoney_csv(output, transactions)
+    if watch and (outputs or formats or output_dir or incremental):
+        raise click.UsageError("--watch serves the transactions instead of writing --output")
+
+    if output_dir:
+        if outputs or incremental:
+            raise click.UsageError("--output-dir replaces --output and --incremental")
+        if len(formats) > 1 or 'sqlite' in formats:
+            raise click.UsageError("--output-dir takes a single --format other than sqlite")
+
+    formats = formats or ('dkb',)
+    outputs = outputs or (sys.stdout,)
+    if len(formats) != len(outputs):
+        raise click.UsageError("--format and --output must be given the same number of times")
+    to_stdout = [output.name in ('-', sys.stdout.name) for output in outputs]
+    if sum(to_stdout) > 1:
+        raise click.UsageError("only one --output may be stdout")
+    if any(format == 'sqlite' and stdout for format, stdout in zip(formats, to_stdout)):
+        raise click.UsageError("--format sqlite requires --output")
+
+    manifest = None
+    if incremental:
+        if len(outputs) > 1:
+            raise click.UsageError("--incremental supports a single --output")
+        output, format = outputs[0], formats[0]
+        if output.name in ('-', sys.stdout.name):
+            raise click.UsageError("--incremental requires --output")
+        # the output is merged back in (dkb, json) or updated in place (sqlite)
+        if format not in ('dkb', 'json', 'sqlite'):
+            raise click.UsageError(f"--incremental does not support the {format} format")
+
+    PdftotextExtractor.page_jobs = page_jobs
+    try:
+        get_extractor(backend)
+    except ImportError as e:
+        raise click.UsageError(f"--backend {backend} is not available: {e}")
+
+    cache = None if no_cache else StatementCache(cache_dir, cache_size * 1024 * 1024, backend)
+    balances = BalanceIndex(None if no_cache else os.path.join(cache_dir, "balances.json"))
+    filters = StatementFilter(since and since.date(), until and until.date(), accounts)
+    settings = f"{since} {until} {sorted(filters.accounts)}"
+    if incremental:
+        manifest = Manifest(f"{output.name}.manifest.json", settings)
+        if not os.path.exists(output.name):
+            manifest.files = {}  # the output is gone, start over
+        # with other settings every file is parsed again, a dkb or json output is written anew
+        resume = bool(manifest.files)
+    if watch:
+        watch_statements(directories, listen, interval, jobs, cache, backend, filters, keep_duplicates, balances)
+        return
+
+    counts = Counter()
+    stats = RunStats() if stats_table or stats_json else None
+    statements = []
+    duplicates = None if keep_duplicates else []
+
+    def parsed_statements():
+        for transactions_statement, statement in iter_statements(list(directories), jobs, cache, manifest, stats, backend, filters, duplicates):
+            statements.append(statement)
+            if filters:
+                transactions_statement = [t for t in transactions_statement if filters.accepts(t)]
+            counts["statements"] += 1
+            counts["transactions"] += len(transactions_statement)
+            yield transactions_statement, statement
+
+    if output_dir:
+        partitions = PartitionedOutput(output_dir, formats[0], settings=settings)
+        if not partitions.check_settings():
+            raise click.UsageError(f"{output_dir} was written with other --since, --until or --account, write to another --output-dir")
+        for transactions_statement, statement in parsed_statements():
+            partitions.add(transactions_statement, statement)
+        start = time.perf_counter()
+        counts["partitions"] = partitions.write(jobs)
+        if stats:
+            stats.write = time.perf_counter() - start
+        transactions = None
     else:
-        transactions_to_csv(output, transactions)
+        transactions = (t for transactions_statement, _ in parsed_statements() for t in transactions_statement)
+    if manifest and resume and format in EXPORT_READERS:
+        with open(output.name, newline='') as f:
+            transactions = merge_transactions(EXPORT_READERS[format](f), transactions)
+
+    if transactions is not None:
+        if stats:
+            transactions = timed(transactions, counts)
+        sinks = [
+            SqliteSink(output.name, statements) if format == 'sqlite' else SINKS[format](output)
+            for format, output in zip(formats, outputs)
+        ]
+        start = time.perf_counter()
+        # row order does not matter in a database
+        sort = sort and any(format != 'sqlite' for format in formats)
+        write_transactions(sinks, transactions, sort=sort, buffer_size=sort_buffer)
+        if stats:
+            # writing pulls the transactions through the parsers, their share is not writing time
+            stats.write = time.perf_counter() - start - counts["upstream"]
+
+    balances.update(statements)
+    balances.check()
+    balances.save()
+    problems = balances.problems(filters.accepts_account, directories)
+    for problem in problems:
+        logging.warning(f"balance chain: {problem}")
+
+    summary = f"Parsed {counts['transactions']} transactions from {counts['statements']} statements"
+    if duplicates:
+        summary += f", skipped {len(duplicates)} duplicate files"
+    if output_dir:
+        summary += f", wrote {counts['partitions']} of {len(partitions.partitions)} partitions"
+    if problems:
+        summary += f", {len(problems)} balance chain problems"
+    click.echo(summary, err=True)
+    if cache:
+        logging.info(f"cache: {cache.summary()}")
+
+    if manifest:
+        output.close()
+        manifest.save()
+
+    if stats_table:
+        stats.to_table(sys.stderr)
+    if stats_json:
+        stats.to_json(stats_json)
+
+
+def timed(iterable, counts):
+    """yields from iterable and adds the time spent waiting for it to counts['upstream']"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            counts["upstream"] += time.perf_counter() - start
+            return
+        counts["upstream"] += time.perf_counter() - start
+        yield item
+
+
+@lru_cache(maxsize=None)
+def build_main():
+    """returns main, the click command that calls _main, click is only imported here"""
+    import click
+    decorators = [
+        click.command("main"),
+        click.argument('directories', nargs=-1, required=True, type=click.Path(exists=True, file_okay=False, dir_okay=True)),
+        click.option('--output', '-o', 'outputs', type=click.File('w'), multiple=True, help='Output file (default: stdout), can be repeated with one --format each'),
+        click.option('--format', '-f', 'formats', type=click.Choice(sorted(SINKS)), multiple=True, help='Output format: dkb (default), json, moneymoney or sqlite (requires --output), can be repeated with one --output each'),
+        click.option('--output-dir', type=click.Path(file_okay=False, dir_okay=True), help='Write one file per statement kind, account and year to this directory instead of --output'),
+        click.option('--jobs', '-j', type=click.IntRange(min=1), default=os.cpu_count() or 1, show_default='number of cores', help='Number of statements parsed in parallel'),
+        click.option('--cache-dir', type=click.Path(file_okay=False, dir_okay=True), default=os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'dkbparse'), show_default=True, help='Directory for cached pdftotext output and parsed statements'),
+        click.option('--cache-size', type=click.IntRange(min=0), default=256, show_default=True, help='Maximum cache size in MB'),
+        click.option('--no-cache', is_flag=True, help='Neither read nor write the cache'),
+        click.option('--incremental', '-i', is_flag=True, help='Only parse statements not yet in the output and merge them into it'),
+        click.option('--sort/--no-sort', default=True, help='Sort transactions by value date, newest first (default), or write them as they are parsed'),
+        click.option('--sort-buffer', type=click.IntRange(min=1), default=SORT_BUFFER, show_default=True, help='Transactions sorted in memory before sorted runs are spilled to temporary files'),
+        click.option('--stats', 'stats_table', is_flag=True, help='Print timings and pattern statistics per file and in total to stderr'),
+        click.option('--stats-json', type=click.File('w'), help='Write timings and pattern statistics as JSON to this file'),
+        click.option('--backend', '-b', type=click.Choice(sorted(EXTRACTORS)), default='pdftotext', show_default=True, help='PDF text extraction: pdftotext subprocess or in-process pypdf (optional dependency)'),
+        click.option('--page-jobs', type=click.IntRange(min=1), default=1, show_default=True, help='pdftotext processes per document, in page ranges (requires pdfinfo)'),
+        click.option('--since', type=click.DateTime(['%Y-%m-%d']), help='Only transactions valued on or after this date (YYYY-MM-DD)'),
+        click.option('--until', type=click.DateTime(['%Y-%m-%d']), help='Only transactions valued on or before this date (YYYY-MM-DD)'),
+        click.option('--account', '-a', 'accounts', multiple=True, help='Only this account or card number (X matches masked digits), can be repeated'),
+        click.option('--keep-duplicates', is_flag=True, help='Parse statement files with identical content more than once'),
+        click.option('--watch', '-w', is_flag=True, help='Keep running, parse statements as they arrive and serve the transactions on --listen'),
+        click.option('--listen', default='127.0.0.1:8765', show_default=True, help='host:port or unix:path to serve transactions on with --watch'),
+        click.option('--interval', type=click.FloatRange(min=0.1), default=10, show_default=True, help='Seconds between scans for new statements with --watch'),
+        click.option('--verbose', '-v', is_flag=True, help='Enable verbose logging'),
+    ]
+    command = _main
+    for decorator in reversed(decorators):
+        command = decorator(command)
+    return command
+
+
+def __getattr__(name):
+    # main is built on first use, so importing dkbparse does not import click
+    if name == "main":
+        return build_main()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# commands that are run without click
+COMMANDS = {"parse-file": parse_file, "merge": merge}
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+    build_main()()